@@ -1,14 +1,23 @@
 import os
 import dotenv
 dotenv.load_dotenv()
-import copy
 import json
+import time
+import queue
+import threading
+from concurrent.futures import Future
 from typing import Union
+import storage
+import metrics
+import llm
+import retrieval
+from story_format import get_text, get_info, get_summary, split_scenes, CompletionParser, TITLE, SCENE
 from cerebras.cloud.sdk import Cerebras
 from cerebras.cloud.sdk.types import chat as cerebras_types
 
 client = Cerebras(
     api_key=os.environ.get("CEREBRAS_API_KEY"),  # This is the default and can be omitted
+    max_retries=0,  # llm.complete does the retrying, within its deadline and with fallback
 )
 
 prompt_bases = [
@@ -55,104 +64,292 @@ prompt_bases = [
 def get_full_prompt(prompt_base, topic, language, world, current_content):
     return prompt_base + f"Topic: {topic}\nLanguage: {language}\nWorld: {world}\nCurrent Content:\n" + current_content + "\nTo repeat for clarity:\n" +prompt_base
 
-def get_response(prompt):
-    response = client.chat.completions.create(
+# Prompts are kept under this many (estimated) tokens by trimming the world context, see build_prompt
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", 8000))
+CHARS_PER_TOKEN = 4  # rough average, good enough for budgeting without a tokenizer
+RECENT_SCENES = 2  # scenes of the current story that are always sent verbatim if they fit
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def compress_current_content(content, max_tokens, recent_scenes=RECENT_SCENES):
+    """Keep the last few scenes of the current story as they are and replace earlier ones with their summaries"""
+    scenes = split_scenes(content)
+    if not scenes:
+        return "<empty>"
+    for keep in range(min(recent_scenes, len(scenes)), 0, -1):
+        earlier = [summary for summary in map(get_summary, scenes[:-keep]) if summary]
+        text = ""
+        if earlier:
+            text = "Summary of earlier scenes:\n" + "\n".join(earlier) + "\n"
+        text += "\n".join(scenes[-keep:])
+        if estimate_tokens(text) <= max_tokens:
+            break
+    if estimate_tokens(text) > max_tokens:
+        # Even the last scene alone is too long, keep its end since that's where the next scene continues from
+        text = text[-max_tokens * CHARS_PER_TOKEN:]
+    return text
+
+def select_previous_plots(summaries, current_content_idx, max_tokens, candidates=None):
+    """Pick the summaries of other stories to include until max_tokens is used up
+
+    Candidates (story indexes) are taken in the given order, by default the most recent story first.
+    """
+    selected = []
+    used = 0
+    for i in (reversed(range(len(summaries))) if candidates is None else candidates):
+        if i == current_content_idx or i >= len(summaries) or not summaries[i]:
+            continue
+        cost = estimate_tokens(json.dumps(summaries[i])) + 1
+        if used + cost > max_tokens:
+            continue
+        selected.append(i)
+        used += cost
+    return [summaries[i] for i in sorted(selected)]
+
+def relevant_stories(world_name, world, topic, current_content_idx, top_k=None):
+    """The top_k stories of the world most relevant to the topic and the current story's plot so far"""
+    top_k = retrieval.RETRIEVAL_TOP_K if top_k is None else top_k
+    query = topic
+    if current_content_idx < len(world["stories"]):
+        story = world["stories"][current_content_idx]
+        query += "\n" + story["summary"] + "\n" + story["info"]
+    return retrieval.rank_stories(world_name, query, exclude=[current_content_idx])[:top_k]
+
+def build_prompt(prompt_base, topic, language, world, current_content_idx, token_budget=PROMPT_TOKEN_BUDGET, world_name=None):
+    """get_full_prompt with the world context trimmed to fit token_budget
+
+    The prompt base (sent twice) is never trimmed. Of what is left, the current story may use up to
+    60% and the summaries of previous stories get the rest. With a world_name (and retrieval.RETRIEVAL_TOP_K set),
+    only the summaries of the stories most relevant to this one are candidates, see relevant_stories.
+    Returns the prompt and its estimated token count.
+    """
+    fixed_tokens = estimate_tokens(get_full_prompt(prompt_base, topic, language, '{"Description":' + json.dumps(world["description"]) + ', "Previous Plots/Stories":[]}', ""))
+    available = max(token_budget - fixed_tokens, 0)
+    current_content = compress_current_content(world["backstory"][current_content_idx], max(available * 6 // 10, 1))
+    candidates = None
+    if world_name is not None and retrieval.RETRIEVAL_TOP_K:
+        candidates = relevant_stories(world_name, world, topic, current_content_idx)
+    previous_plots = select_previous_plots(
+        [story["summary"] for story in world["stories"]], current_content_idx, available - estimate_tokens(current_content),
+        candidates)
+    prompt = get_full_prompt(
+        prompt_base, topic, language,
+        '{"Description":' + json.dumps(world["description"]) + ', "Previous Plots/Stories":' + json.dumps(previous_plots) + '}',
+        current_content)
+    return prompt, estimate_tokens(prompt)
+
+def get_response(prompt, stream=False):
+    # Rate limited, retried and queued by the gateway in llm.py; the model is set there too
+    response = llm.complete(
+        client,
         messages=[
             {
                 "role": "user",
                 "content": prompt,
             }
         ],
-        model="qwen-3-235b-a22b-instruct-2507",
+        stream=stream,
     )
     return response
 
-def get_text(content):
-    lines = content.split("\n")
-    in_info = False
-    in_summary = False
-    filtered_lines = []
-    for line in lines:
-        if line.startswith("<info>"):
-            in_info = True
-        elif line.startswith("</info>"):
-            in_info = False
-        elif line.startswith("<summary>"):
-            in_summary = True
-        elif line.startswith("</summary>"):
-            in_summary = False
-        elif line.startswith("<end>"):
-            break
-        elif not in_info and not in_summary:
-            filtered_lines.append(line)
-    return "\n".join(filtered_lines).strip()
-
-def get_info(content):
-    lines = content.split("\n")
-    in_info = False
-    info_lines = []
-    for line in lines:
-        if line.startswith("<info>"):
-            in_info = True
-        elif line.startswith("</info>"):
-            in_info = False
-        elif in_info:
-            info_lines.append(line)
-    return "\n".join(info_lines).strip()
-
-def get_summary(content):
-    lines = content.split("\n")
-    in_summary = False
-    summary_lines = []
-    for line in lines:
-        if line.startswith("<summary>"):
-            in_summary = True
-        elif line.startswith("</summary>"):
-            in_summary = False
-        elif in_summary:
-            summary_lines.append(line)
-    return "\n".join(summary_lines).strip()
+class StoryStreamFilter:
+    """Incremental version of get_text for completions that arrive in chunks, on top of CompletionParser.
 
-def generate_content(prompt_base, topic, language, world_file, current_content_idx: Union[int, str] = "new"):
-    with open(world_file, "r") as f:
-        world = json.load(f)
+    feed() returns the scene text that can be shown so far. Complete lines come from the parser; the line
+    still being received is shown as it grows once the parser knows it can't turn out to be a tag.
+    """
+    def __init__(self):
+        self.parser = CompletionParser()
+        self.shown = 0  # characters of the incomplete line already sent
+        self.started = False  # leading blank lines are dropped, like the strip() in get_text
+        self.pending_newlines = 0  # trailing blank lines are only sent once more text follows
+        self.out = []
+
+    def feed(self, chunk):
+        self._lines(self.parser.feed(chunk), ended=True)
+        if self.parser.partial_is_text():
+            self._emit(self.parser.partial[self.shown:])
+            self.shown = len(self.parser.partial)
+        return self._flush()
+
+    def close(self):
+        self._lines(self.parser.close(), ended=False)
+        return self._flush()
+
+    def _lines(self, segments, ended):
+        for kind, line in segments:
+            if kind in (TITLE, SCENE):
+                # Only a line that was shown while incomplete has shown > 0, and it is the first one completed
+                self._emit(line[self.shown:])
+                if ended and self.started:
+                    self.pending_newlines += 1
+            self.shown = 0
+
+    def _flush(self):
+        text = "".join(self.out)
+        self.out = []
+        return text
+
+    def _emit(self, text):
+        if not self.started:
+            text = text.lstrip()
+            if not text:
+                return
+            self.started = True
+        if text:
+            self.out.append("\n" * self.pending_newlines + text)
+            self.pending_newlines = 0
+
+def prepare_generation(prompt_base, topic, language, world_file, current_content_idx: Union[int, str] = "new"):
+    world = storage.load_world(storage.world_name(world_file))
     if current_content_idx == "new":
         world["backstory"].append("")
         current_content_idx = len(world["backstory"]) - 1
+    elif int(current_content_idx) < 0:
+        current_content_idx = len(world["backstory"]) + int(current_content_idx)
+    current_content_idx = int(current_content_idx)
 
-    concise_world = copy.deepcopy(world)
-    for i in range(len(world["backstory"])):
-        concise_world["backstory"][i] = get_summary(world["backstory"][i])
-    concise_world["backstory"][current_content_idx] = ""
-
-    response = get_response(
-        get_full_prompt(
-            prompt_base, topic, language,
-            '{"Description":' + json.dumps(concise_world["description"]) + ', "Previous Plots/Stories":' + json.dumps(concise_world["backstory"]) + '}',
-            world["backstory"][current_content_idx] if world["backstory"][current_content_idx] != "" else "<empty>"))
-    print(response.usage.total_tokens) # type: ignore
-    completion = "\n" + response.choices[0].message.content # type: ignore
+    # Uses the summaries extracted when each scene was saved, see storage.extract_fields
+    prompt, prompt_tokens = build_prompt(prompt_base, topic, language, world, current_content_idx,
+                                         world_name=storage.world_name(world_file))
+    return world, current_content_idx, prompt, prompt_tokens
 
+def save_completion(world, world_file, current_content_idx, completion, language=None):
     world["backstory"][current_content_idx] += completion
-    with open(world_file, "w") as f:
-        json.dump(world, f)
+    storage.append_scene(storage.world_name(world_file), current_content_idx, completion, language)
+
+def record_usage(world_name, prompt_tokens, usage):
+    """Log and count the tokens a completion for this world used"""
+    print(f"Prompt tokens: ~{prompt_tokens} estimated, {usage.prompt_tokens} actual; total tokens: {usage.total_tokens}")
+    metrics.llm_prompt_tokens.inc(usage.prompt_tokens, world=world_name)
+    metrics.llm_completion_tokens.inc(usage.total_tokens - usage.prompt_tokens, world=world_name)
+
+def generate_completion(prompt, prompt_tokens=None, world_name=""):
+    """Run the prompt and return the completion (in the form it is saved in) and the total tokens used"""
+    start = time.perf_counter()
+    try:
+        response = get_response(prompt)
+    except Exception:
+        metrics.llm_errors.inc(mode="complete")
+        raise
+    metrics.llm_request_duration.observe(time.perf_counter() - start, mode="complete")
+    record_usage(world_name, prompt_tokens, response.usage)
+    completion = "\n" + response.choices[0].message.content # type: ignore
+    return completion, response.usage.total_tokens # type: ignore
+
+# Identical calls continuing a story that arrive while one is running wait for and share its result
+# (e.g. a double-clicked "continue"), instead of generating and appending the scene twice. Requests for a
+# new story are never shared: two readers starting one with the same (default) topic each get their own.
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+def generate_content(prompt_base, topic, language, world_file, current_content_idx: Union[int, str] = "new"):
+    if current_content_idx == "new":
+        return _generate_content(prompt_base, topic, language, world_file, current_content_idx)
+    key = (storage.world_name(world_file), str(current_content_idx), prompt_base, topic, language)
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _in_flight[key] = future
+    if not owner:
+        return future.result()
+    try:
+        result = _generate_content(prompt_base, topic, language, world_file, current_content_idx)
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _in_flight_lock:
+            _in_flight.pop(key, None)
+
+def _check_world(name):
+    """Checked before locking, so requests for worlds that don't exist leave no lock behind"""
+    if not storage.world_exists(name):
+        raise LookupError(f"World '{name}' does not exist")
+
+def _generate_content(prompt_base, topic, language, world_file, current_content_idx):
+    # The world stays locked from loading it until the new scene is saved, so that concurrent generations
+    # for the same world queue up and each one sees the scenes written before it
+    _check_world(storage.world_name(world_file))
+    with storage.world_lock(storage.world_name(world_file)):
+        world, current_content_idx, prompt, prompt_tokens = prepare_generation(prompt_base, topic, language, world_file, current_content_idx)
+        completion, _ = generate_completion(prompt, prompt_tokens, storage.world_name(world_file))
+
+        save_completion(world, world_file, current_content_idx, completion, language)
     return get_text(completion), completion.endswith("<end>")
 
+_STREAM_DONE = object()
+
+def generate_content_stream(prompt_base, topic, language, world_file, current_content_idx: Union[int, str] = "new"):
+    """Same as generate_content, but yields the scene text (as filtered by get_text) while it is generated.
+
+    The generation runs on its own thread, which holds the world's lock (and an LLM slot) until the completion
+    is saved, and hands the text over through a queue: however slowly the caller consumes it, other writers to
+    the world only wait for the LLM. The completion is saved even if the caller stops reading.
+    """
+    _check_world(storage.world_name(world_file))
+    pieces = queue.Queue()
+    threading.Thread(target=_stream_to_queue, name="story-stream", daemon=True,
+                     args=(pieces, prompt_base, topic, language, world_file, current_content_idx)).start()
+    while True:
+        piece = pieces.get()
+        if piece is _STREAM_DONE:
+            return
+        if isinstance(piece, BaseException):
+            raise piece
+        yield piece
+
+def _stream_to_queue(pieces, prompt_base, topic, language, world_file, current_content_idx):
+    """Body of generate_content_stream's thread: puts text, then _STREAM_DONE or the exception that stopped it"""
+    try:
+        name = storage.world_name(world_file)
+        with storage.world_lock(name):
+            world, current_content_idx, prompt, prompt_tokens = prepare_generation(prompt_base, topic, language, world_file, current_content_idx)
+            text_filter = StoryStreamFilter()
+            completion = "\n"
+            start = time.perf_counter()
+            first_token = None
+            try:
+                for chunk in get_response(prompt, stream=True):
+                    usage = getattr(chunk, "usage", None)
+                    if usage is not None:
+                        record_usage(name, prompt_tokens, usage)
+                    if not chunk.choices:
+                        continue
+                    piece = chunk.choices[0].delta.content
+                    if not piece:
+                        continue
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                        metrics.llm_time_to_first_token.observe(first_token)
+                    completion += piece
+                    text = text_filter.feed(piece)
+                    if text:
+                        pieces.put(text)
+            except Exception:
+                metrics.llm_errors.inc(mode="stream")
+                raise
+            metrics.llm_request_duration.observe(time.perf_counter() - start, mode="stream")
+            text = text_filter.close()
+            if text:
+                pieces.put(text)
+
+            save_completion(world, world_file, current_content_idx, completion, language)
+        pieces.put(_STREAM_DONE)
+    except BaseException as e:
+        pieces.put(e)
+
 def create_new_world(name, description):
-    world = {
-        "description": description,
-        "backstory": [""]
-    }
-    with open(f"data/{name}.json", "w") as f:
-        json.dump(world, f)
+    storage.create_world(name, description, [""])
     return
 
 def clear_world(name):
-    with open(f"data/{name}.json", "r") as f:
-        world = json.load(f)
-    world["backstory"] = []
-    with open(f"data/{name}.json", "w") as f:
-        json.dump(world, f)
+    storage.clear_world(name)
     return
 
 if __name__ == "__main__":
@@ -0,0 +1,53 @@
+"""Compare story_format.parse_completion (one pass) with calling get_text, get_info and get_summary.
+
+    python benchmarks/bench_parser.py [scenes per story] [stories]
+
+Builds the stories from the same generated scene (5 scenes and 200 stories by default, about 2 MB), times each
+approach as the best of 5 runs, and prints the times plus parse_completion's speedup over the three functions.
+CompletionParser fed 16 character chunks, as when streaming, is timed for reference.
+"""
+import os
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from story_format import CompletionParser, parse_completion, get_text, get_info, get_summary, is_ended
+
+def make_scene(n):
+    lines = ["", "<info>", f"Plan for scene {n}: the characters argue, then make up.", "</info>"]
+    if n == 0:
+        lines.append("# La Grande Aventure")
+    lines.append(f"### Scène {n + 1}")
+    for i in range(30):
+        lines.append(f"_(ALICE regarde par la fenêtre, ligne {i}.)_" if i % 5 == 0 else f"ALICE: Je voudrais que quelque chose d'excitant arrive, ligne {i}.")
+    lines += ["<summary>", f"Alice and the stranger meet in scene {n + 1}.", "</summary>"]
+    return "\n".join(lines)
+
+def bench(label, function, stories, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for story in stories:
+            function(story)
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<40} {best * 1000:8.2f} ms")
+    return best
+
+def three_functions(content):
+    return get_text(content), get_info(content), get_summary(content), is_ended(content)
+
+def chunked(content, chunk_size=16):
+    parser = CompletionParser()
+    for i in range(0, len(content), chunk_size):
+        parser.feed(content[i:i + chunk_size])
+    parser.close()
+
+if __name__ == "__main__":
+    scenes = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    story_count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    stories = ["".join(make_scene(n) for n in range(scenes)) + "\n### FIN.\n<end>" for _ in range(story_count)]
+    size = sum(len(story) for story in stories)
+    print(f"{story_count} stories of {scenes} scenes, {size / 1e6:.1f} MB")
+    old = bench("get_text + get_info + get_summary", three_functions, stories)
+    new = bench("parse_completion", parse_completion, stories)
+    bench("CompletionParser, 16 character chunks", chunked, stories)
+    print(f"parse_completion speedup: {old / new:.2f}x")
@@ -0,0 +1,100 @@
+"""Prompt size, relevance and cost of choosing previous plots by TF-IDF retrieval instead of recency.
+
+Builds a world whose stories are about a handful of distinct topics, then, for each topic, builds the prompt
+for a new story the way generate_content does: with every summary (the original prompt), with the budgeted
+most recent summaries (PLOT_RETRIEVAL_TOP_K=0) and with the top-k retrieved ones.
+
+    python benchmarks/bench_retrieval.py [stories] [scenes per story] [top k]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Topic as the reader would type it -> words the stories about it use
+TOPICS = {
+    "a dragon guarding its treasure": ["dragon", "fire", "scales", "cave", "treasure", "knight", "wings", "mountain"],
+    "a ship lost in a storm": ["ship", "sailor", "storm", "island", "whale", "harbour", "anchor", "waves"],
+    "a rocket to another planet": ["rocket", "planet", "astronaut", "stars", "orbit", "alien", "station", "moon"],
+    "the exam nobody studied for": ["teacher", "homework", "exam", "classroom", "friends", "library", "recess", "principal"],
+    "the fox and the owl": ["fox", "owl", "trees", "mushrooms", "river", "hunter", "cabin", "wolves"],
+}
+FILLER = ["Alice", "the", "stranger", "decides", "to", "help", "but", "hides", "a", "secret", "and", "finally", "they", "agree"]
+
+def make_scene(rng, topic, story, n):
+    words = TOPICS[topic]
+    summary = " ".join(rng.choice(words + FILLER) for _ in range(30))
+    info = " ".join(rng.choice(words + FILLER) for _ in range(40))
+    return f"\n<info>\n{info}\n</info>\n### Scene {n + 1} of story {story}\nALICE: ...\n<summary>\n{summary}\n</summary>"
+
+def timed(function, repeat=20):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return result, best * 1000
+
+def main():
+    story_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    scenes = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    top_k = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    workdir = tempfile.mkdtemp(prefix="duo-bench-")
+    os.chdir(workdir)
+    os.makedirs("data")
+    try:
+        run(story_count, scenes, top_k)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def run(story_count, scenes, top_k):
+    import storage
+    import backend
+    import retrieval
+
+    rng = random.Random(0)
+    topics = list(TOPICS)
+    story_topics = [rng.choice(topics) for _ in range(story_count)]
+    storage.create_world("bench", "A world for benchmarking plot retrieval")
+    start = time.perf_counter()
+    for story, topic in enumerate(story_topics):
+        for n in range(scenes):
+            storage.append_scene("bench", story, make_scene(rng, topic, story, n))
+    print(f"{story_count} stories of {scenes} scenes written in {time.perf_counter() - start:.2f} s (index kept up to date)")
+
+    # Index costs: from scratch, and for one more scene
+    _, cold = timed(lambda: (retrieval._follower.positions.clear(), retrieval._reset_world("bench"), retrieval._follower.refresh("bench")), repeat=3)
+    start = time.perf_counter()
+    storage.append_scene("bench", story_count, make_scene(rng, topics[1], story_count, 0))
+    incremental = (time.perf_counter() - start) * 1000
+    story_topics.append(topics[1])
+    print(f"index build from the log: {cold:.1f} ms; append one scene (write, fsync and index): {incremental:.1f} ms")
+
+    world = storage.load_world("bench")
+    world["backstory"].append("")
+    new_idx = len(world["backstory"]) - 1
+    all_summaries = [story["summary"] for story in world["stories"]]
+    prompt_base = backend.prompt_bases[0]
+
+    for topic in topics:
+        print(f"\n{topic!r:<34} {'tokens':>8} {'plots':>6} {'on topic':>9} {'build ms':>9}")
+        full_prompt = backend.get_full_prompt(prompt_base, topic, "French", '{"Description":' + json.dumps(world["description"])
+                                              + ', "Previous Plots/Stories":' + json.dumps(all_summaries) + '}', "<empty>")
+        rows = [("every summary", backend.estimate_tokens(full_prompt), full_prompt, None)]
+        retrieval.RETRIEVAL_TOP_K = 0
+        (prompt, tokens), ms = timed(lambda: backend.build_prompt(prompt_base, topic, "French", world, new_idx, world_name="bench"))
+        rows.append(("budget, most recent", tokens, prompt, ms))
+        retrieval.RETRIEVAL_TOP_K = top_k
+        (prompt, tokens), ms = timed(lambda: backend.build_prompt(prompt_base, topic, "French", world, new_idx, world_name="bench"))
+        rows.append((f"top {top_k} retrieved", tokens, prompt, ms))
+        for label, tokens, included, ms in rows:
+            plots = [i for i, summary in enumerate(all_summaries) if summary and json.dumps(summary) in included]
+            on_topic = sum(story_topics[i] == topic for i in plots) / len(plots) if plots else 0.0
+            print(f"{label:<34} {tokens:8d} {len(plots):6d} {on_topic:9.0%} {ms if ms is not None else float('nan'):9.2f}")
+
+if __name__ == "__main__":
+    main()
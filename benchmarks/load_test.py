@@ -0,0 +1,202 @@
+"""Load test for server.py, with fake Cerebras and translate backends so nothing is paid for.
+
+Starts the server in this process on a scratch copy of the app, fills it with worlds of each size,
+then runs concurrent clients against every endpoint and reports latency percentiles, throughput and
+world storage I/O per endpoint (from storage's byte counters, so the benchmark's own HTTP traffic isn't
+counted), plus the process's peak RSS so far: client and server share the process, so memory can't be split by endpoint.
+
+    python benchmarks/load_test.py --clients 8 --requests 50 --world-sizes 5,50
+    python benchmarks/load_test.py --llm-latency 2 --token-rate 300 --json bench.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import resource
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_DIR)
+
+VOCABULARY = ["bonjour", "le monde", "fenêtre", "aventure", "quelque chose", "excitant", "étranger", "village"]
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+def read_io():
+    """Bytes of world logs read from and written to disk so far"""
+    import metrics
+    return metrics.world_read_bytes.total(), metrics.world_write_bytes.total()
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 if sys.platform != "darwin" else rss / (1024 * 1024)
+
+def setup_workdir():
+    """Scratch directory with the page and images, so the benchmark never touches the real data/"""
+    workdir = tempfile.mkdtemp(prefix="duo-bench-")
+    shutil.copy(os.path.join(REPO_DIR, "duo.html"), workdir)
+    shutil.copytree(os.path.join(REPO_DIR, "static"), os.path.join(workdir, "static"))
+    os.makedirs(os.path.join(workdir, "data"))
+    return workdir
+
+def populate(storage, fake_llm, world_count, stories_per_world, scenes_per_story):
+    names = []
+    for w in range(world_count):
+        name = f"bench{stories_per_world}_{w}"
+        storage.create_world(name, f"A benchmark world with {stories_per_world} stories")
+        for s in range(stories_per_world):
+            for n in range(scenes_per_story):
+                storage.append_scene(name, s, "\n" + fake_llm.make_completion(n + 1))
+        names.append(name)
+    return names
+
+def request(base_url, method, path, body=None, headers=None):
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    req = urllib.request.Request(base_url + path, data=data, method=method, headers=headers or {})
+    with urllib.request.urlopen(req, timeout=120) as response:
+        return response.read()
+
+def run_endpoint(base_url, label, make_request, clients, total_requests):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    io_before = read_io()
+
+    def one(i):
+        nonlocal errors
+        method, path, body = make_request(i)
+        start = time.perf_counter()
+        try:
+            request(base_url, method, path, body)
+        except (urllib.error.URLError, OSError) as e:
+            with lock:
+                errors += 1
+            return
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(one, range(total_requests)))
+    wall = time.perf_counter() - start
+    io_after = read_io()
+
+    latencies.sort()
+    result = {
+        "endpoint": label,
+        "requests": total_requests,
+        "errors": errors,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "throughput_rps": len(latencies) / wall if wall else 0.0,
+        "world_read_kb": (io_after[0] - io_before[0]) / 1024,
+        "world_written_kb": (io_after[1] - io_before[1]) / 1024,
+        "process_peak_rss_mb": peak_rss_mb(),
+    }
+    return result
+
+def endpoint_requests(world_names, stories_per_world):
+    """(label, function from request number to (method, path, body)) for every endpoint that is measured"""
+    def story(i):
+        return world_names[i % len(world_names)], i % stories_per_world
+
+    return [
+        ("GET /", lambda i: ("GET", "/", None)),
+        ("GET /static/felixthefox.png", lambda i: ("GET", "/static/felixthefox.png", None)),
+        ("GET /api/get_all_stories", lambda i: ("GET", "/api/get_all_stories", None)),
+        ("GET /api/get_all_stories?mode=list", lambda i: ("GET", "/api/get_all_stories?mode=list", None)),
+        ("GET /api/get_story", lambda i: ("GET", "/api/get_story?world={}&index={}".format(*story(i)), None)),
+        ("POST /api/translate", lambda i: ("POST", "/api/translate",
+                                           {"text": random.choice(VOCABULARY), "source": "fr", "target": "en"})),
+        ("POST /api/generate_story", lambda i: ("POST", "/api/generate_story", {
+            "topic": "adventure", "language": "French", "format": "0",
+            "world_file": f"data/{story(i)[0]}.json", "current_content_idx": story(i)[1]})),
+        ("POST /api/generate_story_stream", lambda i: ("POST", "/api/generate_story_stream", {
+            "topic": "adventure", "language": "French", "format": "0",
+            "world_file": f"data/{story(i)[0]}.json", "current_content_idx": "new"})),
+    ]
+
+def print_table(world_size, results):
+    print(f"\n== {world_size} stories per world ==")
+    print(f"{'endpoint':<38} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8} {'errors':>6} {'read KB':>9} {'written KB':>10} {'peak RSS MB':>12}")
+    for r in results:
+        print(f"{r['endpoint']:<38} {r['p50_ms']:9.1f} {r['p95_ms']:9.1f} {r['p99_ms']:9.1f} {r['throughput_rps']:8.1f} "
+              f"{r['errors']:6d} {r['world_read_kb']:9.0f} {r['world_written_kb']:10.0f} {r['process_peak_rss_mb']:12.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients per endpoint")
+    parser.add_argument("--requests", type=int, default=40, help="requests per endpoint")
+    parser.add_argument("--generate-requests", type=int, default=8, help="requests for the generate endpoints")
+    parser.add_argument("--worlds", type=int, default=4, help="worlds of each size")
+    parser.add_argument("--world-sizes", default="5,50", help="comma separated stories per world")
+    parser.add_argument("--scenes", type=int, default=3, help="scenes per story")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="fake LLM seconds to first token")
+    parser.add_argument("--token-rate", type=float, default=2000, help="fake LLM tokens per second")
+    parser.add_argument("--output-tokens", type=int, default=800, help="fake LLM tokens per completion")
+    parser.add_argument("--translate-latency", type=float, default=0.05, help="fake translate API seconds per call")
+    parser.add_argument("--workers", type=int, default=16, help="server worker threads")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    workdir = setup_workdir()
+    os.chdir(workdir)
+    import fakes
+    import backend
+    import storage
+    import translate
+    import server
+
+    fake_llm = fakes.FakeCerebras(args.llm_latency, args.token_rate, args.output_tokens, end_every=0)
+    backend.client = fake_llm
+    translate_server, translate.TRANSLATE_API_URL = fakes.start_fake_translate_server(latency=args.translate_latency)
+
+    class QuietHandler(server.MyHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    httpd = server.PooledHTTPServer(("127.0.0.1", 0), QuietHandler, max_workers=args.workers, max_queued=1024)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    print(f"Benchmarking {base_url} in {workdir}")
+
+    all_results = {}
+    try:
+        for world_size in [int(size) for size in args.world_sizes.split(",")]:
+            for name in storage.list_worlds():
+                storage.delete_world(name)
+            start = time.perf_counter()
+            world_names = populate(storage, fake_llm, args.worlds, world_size, args.scenes)
+            print(f"\nCreated {args.worlds} worlds of {world_size} stories in {time.perf_counter() - start:.1f} s")
+            results = []
+            for label, make_request in endpoint_requests(world_names, world_size):
+                count = args.generate_requests if "generate" in label else args.requests
+                results.append(run_endpoint(base_url, label, make_request, args.clients, count))
+            print_table(world_size, results)
+            all_results[world_size] = results
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        translate_server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump({"args": vars(args), "results": all_results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import json
+import time
+import threading
+import http.server
+from types import SimpleNamespace
+from urllib.parse import urlparse, parse_qs
+
+# Local stand-ins for the external services, for testing and benchmarking without network access.
+#
+#   python fakes.py translate 7100
+#   TRANSLATE_API_URL=http://localhost:7100/translate python server.py
+#
+#   backend.client = fakes.FakeCerebras(latency=0.5, token_rate=500, output_tokens=800)
+
+class FakeCerebras:
+    """Replacement for backend.client that writes placeholder scenes in the completion format the prompts ask for
+
+    latency: seconds before the first token, token_rate: tokens per second after that,
+    output_tokens: roughly how long each completion is, end_every: every n-th completion ends its story (0 = never).
+    """
+    def __init__(self, latency=0.5, token_rate=500.0, output_tokens=800, end_every=5):
+        self.latency = latency
+        self.token_rate = token_rate
+        self.output_tokens = output_tokens
+        self.end_every = end_every
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def make_completion(self, n):
+        lines = ["<info>", f"Plan for scene {n}: the characters meet and argue.", "</info>", f"### Scène {n}"]
+        words = 0
+        i = 0
+        # About 4 characters per token, like backend.estimate_tokens assumes
+        while words * 5 < self.output_tokens * 4:
+            line = "_(ALICE regarde par la fenêtre.)_" if i % 5 == 0 else f"ALICE: Je voudrais que quelque chose d'excitant arrive, numéro {i}."
+            lines.append(line)
+            words += len(line.split())
+            i += 1
+        lines += ["<summary>", f"Alice waits for an adventure in scene {n}.", "</summary>"]
+        if self.end_every and n % self.end_every == 0:
+            lines += ["### FIN.", "<end>"]
+        return "\n".join(lines)
+
+    def create(self, messages, model=None, stream=False, **kwargs):
+        with self._lock:
+            self.calls += 1
+            n = self.calls
+        content = self.make_completion(n)
+        prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+        completion_tokens = len(content) // 4
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                total_tokens=prompt_tokens + completion_tokens)
+        time.sleep(self.latency)
+        if stream:
+            return self._stream(content, usage)
+        if self.token_rate:
+            time.sleep(completion_tokens / self.token_rate)
+        return SimpleNamespace(usage=usage, choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    def _stream(self, content, usage):
+        chunk_size = 16  # characters, about 4 tokens
+        for i in range(0, len(content), chunk_size):
+            if self.token_rate:
+                time.sleep(chunk_size / 4 / self.token_rate)
+            delta = SimpleNamespace(content=content[i:i + chunk_size])
+            yield SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=delta)])
+        yield SimpleNamespace(usage=usage, choices=[])
+
+class FakeTranslateHandler(http.server.BaseHTTPRequestHandler):
+    """Answers like ftapi.pythonanywhere.com/translate, with the text upper-cased as its "translation" """
+    latency = 0.0  # seconds to wait before answering, to simulate the real API
+    calls = 0
+
+    def do_GET(self):
+        parsed_path = urlparse(self.path)
+        query_params = parse_qs(parsed_path.query)
+        if parsed_path.path != '/translate' or 'text' not in query_params:
+            self.send_response(400)
+            self.end_headers()
+            return
+        FakeTranslateHandler.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        text = query_params['text'][0]
+        response = {
+            "source-language": query_params.get('sl', ['fr'])[0],
+            "source-text": text,
+            "destination-language": query_params.get('dl', ['en'])[0],
+            "destination-text": text.upper(),
+            "pronunciation": {"source-text-phonetic": None},
+            "translations": {"possible-translations": [text.upper()]},
+        }
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_fake_translate_server(port=0, latency=0.0):
+    """Run the fake translate API in a background thread; returns the server and its /translate URL"""
+    handler = type("ConfiguredFakeTranslateHandler", (FakeTranslateHandler,), {"latency": latency})
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, f"http://127.0.0.1:{httpd.server_address[1]}/translate"
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 2 or sys.argv[1] != "translate":
+        print("Usage: python fakes.py translate [port]")
+        sys.exit(1)
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 7100
+    httpd, url = start_fake_translate_server(port)
+    print(f"Fake translate API running on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        httpd.shutdown()
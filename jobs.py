@@ -0,0 +1,168 @@
+import os
+import re
+import json
+import time
+import uuid
+import queue
+import threading
+import backend
+import metrics
+
+# Background story generation: submit() queues a backend.generate_content call and returns a job id
+# right away; a fixed number of worker threads (the most Cerebras calls we make at once) work through the queue.
+
+GENERATION_WORKERS = int(os.environ.get("GENERATION_WORKERS", 4))
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", 100))
+JOB_RETENTION = 3600  # seconds a finished job's result is kept for polling
+# With several server processes (launcher.py), a poll can reach a process other than the one running the job,
+# so each job's state is also written to JOB_STATE_DIR/<id>.json whenever it changes. Unset = single process.
+JOB_STATE_DIR = os.environ.get("JOB_STATE_DIR")
+JOB_STATE_POLL_INTERVAL = 0.2
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+class Job:
+    def __init__(self, prompt_base, topic, language, world_file, current_content_idx):
+        self.id = uuid.uuid4().hex
+        self.args = (prompt_base, topic, language, world_file, current_content_idx)
+        self.status = "queued"  # -> "running" -> "done" or "failed"
+        self.story = None
+        self.ended = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "story": self.story,
+            "ended": self.ended,
+            "error": self.error,
+            "queued_seconds": (self.started or time.time()) - self.created,
+            "run_seconds": (self.finished or time.time()) - self.started if self.started else None,
+        }
+
+class StoredJob:
+    """A job run by another process, as it last wrote it to JOB_STATE_DIR"""
+    def __init__(self, state):
+        self.state = state
+        self.status = state["status"]
+        self.story = state["story"]
+
+    def to_dict(self):
+        return self.state
+
+def _state_path(job_id):
+    return os.path.join(JOB_STATE_DIR, f"{job_id}.json")
+
+def _store(job):
+    if JOB_STATE_DIR is None:
+        return
+    try:
+        os.makedirs(JOB_STATE_DIR, exist_ok=True)
+        tmp_path = f"{_state_path(job.id)}.tmp.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, "w") as f:
+            json.dump(job.to_dict(), f)
+        os.replace(tmp_path, _state_path(job.id))
+    except OSError as e:
+        print(f"Error saving the state of job {job.id}: {e}")
+
+def _load_stored(job_id):
+    if JOB_STATE_DIR is None or not JOB_ID_PATTERN.match(job_id):
+        return None
+    try:
+        with open(_state_path(job_id)) as f:
+            return StoredJob(json.load(f))
+    except (OSError, ValueError):
+        return None
+
+_queue = queue.Queue(maxsize=JOB_QUEUE_SIZE)
+_jobs = {}
+_jobs_lock = threading.Lock()
+_workers = []
+stats = metrics.Stats(submitted=0, rejected=0, completed=0, failed=0, running=0,
+                      queue_seconds_total=0.0, run_seconds_total=0.0, run_seconds_max=0.0)
+
+def _worker():
+    while True:
+        job = _queue.get()
+        job.status = "running"
+        job.started = time.time()
+        _store(job)
+        stats.count("running")
+        stats.count("queue_seconds_total", job.started - job.created)
+        try:
+            job.story, job.ended = backend.generate_content(*job.args)
+            job.status = "done"
+            stats.count("completed")
+        except Exception as e:
+            print(f"Error in generation job {job.id}: {e}")
+            job.error = str(e)
+            job.status = "failed"
+            stats.count("failed")
+        finally:
+            job.finished = time.time()
+            stats.count("running", -1)
+            stats.observe("run_seconds", job.finished - job.started)
+            _store(job)
+            job.done.set()
+            _queue.task_done()
+
+def _start_workers():
+    with _jobs_lock:
+        while len(_workers) < GENERATION_WORKERS:
+            worker = threading.Thread(target=_worker, name=f"generation-worker-{len(_workers)}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+def _purge_finished():
+    cutoff = time.time() - JOB_RETENTION
+    with _jobs_lock:
+        for job_id in [job_id for job_id, job in _jobs.items() if job.finished and job.finished < cutoff]:
+            del _jobs[job_id]
+    if JOB_STATE_DIR is not None and os.path.isdir(JOB_STATE_DIR):
+        # Every process purges every old state file, including those of processes that have since died
+        for filename in os.listdir(JOB_STATE_DIR):
+            path = os.path.join(JOB_STATE_DIR, filename)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+def submit(prompt_base, topic, language, world_file, current_content_idx="new"):
+    """Queue a generation; raises queue.Full if too many are already waiting"""
+    _start_workers()
+    _purge_finished()
+    job = Job(prompt_base, topic, language, world_file, current_content_idx)
+    try:
+        _queue.put_nowait(job)
+    except queue.Full:
+        stats.count("rejected")
+        raise
+    with _jobs_lock:
+        _jobs[job.id] = job
+    _store(job)
+    stats.count("submitted")
+    return job
+
+def get_job(job_id, wait=0):
+    """The job with this id (None if unknown), after waiting up to `wait` seconds for it to finish"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is not None:
+        if wait > 0:
+            job.done.wait(wait)
+        return job
+    # Maybe another process's job: follow its state file
+    deadline = time.monotonic() + wait
+    job = _load_stored(job_id)
+    while job is not None and job.status in ("queued", "running") and time.monotonic() < deadline:
+        time.sleep(JOB_STATE_POLL_INTERVAL)
+        job = _load_stored(job_id) or job
+    return job
+
+def get_stats():
+    return stats.snapshot(queue_depth=_queue.qsize(), workers=len(_workers))
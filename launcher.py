@@ -0,0 +1,237 @@
+import os
+import sys
+import json
+import time
+import errno
+import select
+import signal
+import socket
+import argparse
+import threading
+import traceback
+import http.client
+import server
+import storage
+import static_files
+import jobs
+
+# Production launcher: pre-forks several server processes on one port, so JSON parsing, markdown rendering and
+# request handling aren't limited to the one core a single Python process gets. The launcher itself serves
+# nothing; it supervises the workers:
+#   - a worker that exits is restarted (after a growing delay if it keeps dying right after starting)
+#   - every HEALTH_CHECK_INTERVAL seconds it asks each worker for /api/status on the worker's own loopback
+#     port (the shared port can't pick a worker); after HEALTH_CHECK_FAILURES failed checks in a row the worker is killed
+#   - SIGTERM or Ctrl+C stops the workers gracefully (in-flight requests finish), killing them after SHUTDOWN_TIMEOUT
+#
+# On Linux every worker binds the port with SO_REUSEPORT and the kernel spreads connections between them;
+# elsewhere the workers accept from one listening socket created before forking.
+# The workers share everything on disk: world writes are serialized across processes by storage.world_lock,
+# caches and indexes notice other processes' writes from the logs' size and inode, the translation cache is SQLite
+# and generation jobs write their state to JOB_STATE_DIR so any worker can answer a poll. Prefetched drafts and
+# metrics are per worker; a worker's own /api/metrics is on its status port (printed when it starts).
+#
+#   python launcher.py [--processes N] [--port P]
+
+SERVER_PROCESSES = int(os.environ.get("SERVER_PROCESSES", os.cpu_count() or 1))
+HEALTH_CHECK_INTERVAL = float(os.environ.get("HEALTH_CHECK_INTERVAL", 10))
+HEALTH_CHECK_TIMEOUT = float(os.environ.get("HEALTH_CHECK_TIMEOUT", 5))
+HEALTH_CHECK_FAILURES = int(os.environ.get("HEALTH_CHECK_FAILURES", 3))
+SHUTDOWN_TIMEOUT = float(os.environ.get("SHUTDOWN_TIMEOUT", 200))  # a story being generated can take minutes
+STARTUP_TIMEOUT = 30  # seconds for a new worker to report its status port
+MIN_UPTIME = 10  # a worker exiting sooner than this counts as crashing on startup
+RESTART_DELAY_MAX = 30
+
+class Worker:
+    def __init__(self, index):
+        self.index = index
+        self.pid = None
+        self.status_port = None
+        self.started = None
+        self.failed_checks = 0  # in a row
+        self.crashes = 0  # exits right after starting, in a row
+        self.restart_at = None  # monotonic time when an exited worker is started again
+
+class StatusRequestHandler(server.MyHTTPRequestHandler):
+    """The workers' loopback status port, polled by the health checks: not worth a log line per check"""
+    def log_message(self, format, *args):
+        pass
+
+def _listen(port, reuse_port):
+    """The port's socket in the launcher: listening and shared with the workers, or only bound with
+    SO_REUSEPORT so the port stays ours (and a port in use is reported) while the workers bind their own"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(("", port))
+    if not reuse_port:
+        sock.listen(int(os.environ.get("SERVER_BACKLOG", 128)))
+        # Every worker waits for connections on this socket and only one gets each; the others mustn't block in accept()
+        sock.setblocking(False)
+    return sock
+
+def _run_worker(port, listener, reuse_port, status_fd):
+    """Body of a forked worker process"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C reaches every process; the launcher does the stopping
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)  # until server.serve() sets up a graceful stop
+    if reuse_port:
+        listener.close()
+        httpd = server.create_server(port, reuse_port=True)
+    else:
+        httpd = server.create_server(port, listener=listener)
+    status = server.PooledHTTPServer(("127.0.0.1", 0), StatusRequestHandler, max_workers=2, max_queued=2)
+    threading.Thread(target=status.serve_forever, name="status-server", daemon=True).start()
+    os.write(status_fd, str(status.server_port).encode())
+    os.close(status_fd)
+    server.serve(httpd)
+    status.shutdown()
+    status.server_close()
+
+def _spawn(worker, port, listener, reuse_port):
+    read_fd, write_fd = os.pipe()
+    sys.stdout.flush()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        code = 1
+        try:
+            _run_worker(port, listener, reuse_port, write_fd)
+            code = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+    os.close(write_fd)
+    worker.pid = pid
+    worker.started = time.monotonic()
+    worker.failed_checks = 0
+    worker.restart_at = None
+    ready, _, _ = select.select([read_fd], [], [], STARTUP_TIMEOUT)
+    data = os.read(read_fd, 16) if ready else b""
+    os.close(read_fd)
+    worker.status_port = int(data) if data.strip() else None
+    if worker.status_port is None:
+        print(f"Worker {worker.index} (pid {pid}) didn't start, killing it")
+        _kill(worker, signal.SIGKILL)
+    else:
+        print(f"Worker {worker.index} started (pid {pid}, status on http://127.0.0.1:{worker.status_port}/api/status)")
+
+def _kill(worker, signum):
+    try:
+        os.kill(worker.pid, signum)
+    except ProcessLookupError:
+        pass
+
+def _reap(workers, stopping):
+    """Collect exited workers and schedule their restarts"""
+    by_pid = {worker.pid: worker for worker in workers if worker.pid is not None}
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        worker = by_pid.get(pid)
+        if worker is None:
+            continue
+        code = os.waitstatus_to_exitcode(status)
+        worker.pid = worker.status_port = None
+        if stopping:
+            continue
+        uptime = time.monotonic() - worker.started
+        worker.crashes = worker.crashes + 1 if uptime < MIN_UPTIME else 0
+        delay = min(2 ** (worker.crashes - 1), RESTART_DELAY_MAX) if worker.crashes else 0
+        worker.restart_at = time.monotonic() + delay
+        reason = f"signal {-code}" if code < 0 else f"code {code}"
+        print(f"Worker {worker.index} (pid {pid}) exited with {reason} after {uptime:.0f} s, restarting in {delay} s")
+
+def _healthy(worker):
+    connection = http.client.HTTPConnection("127.0.0.1", worker.status_port, timeout=HEALTH_CHECK_TIMEOUT)
+    try:
+        connection.request("GET", "/api/status")
+        response = connection.getresponse()
+        return response.status == 200 and json.loads(response.read()).get("status") == "running"
+    except (OSError, ValueError, http.client.HTTPException):
+        return False
+    finally:
+        connection.close()
+
+def _check_health(workers):
+    for worker in workers:
+        if worker.status_port is None:
+            continue
+        if _healthy(worker):
+            worker.failed_checks = 0
+            continue
+        worker.failed_checks += 1
+        print(f"Worker {worker.index} (pid {worker.pid}) failed health check {worker.failed_checks}/{HEALTH_CHECK_FAILURES}")
+        if worker.failed_checks >= HEALTH_CHECK_FAILURES:
+            print(f"Killing unresponsive worker {worker.index} (pid {worker.pid})")
+            _kill(worker, signal.SIGKILL)
+
+def _stop(workers):
+    print("\nStopping workers, waiting for in-flight requests...")
+    for worker in workers:
+        if worker.pid is not None:
+            _kill(worker, signal.SIGTERM)
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+    while any(worker.pid is not None for worker in workers) and time.monotonic() < deadline:
+        time.sleep(0.1)
+        _reap(workers, stopping=True)
+    for worker in workers:
+        if worker.pid is not None:
+            print(f"Worker {worker.index} (pid {worker.pid}) didn't stop in {SHUTDOWN_TIMEOUT:.0f} s, killing it")
+            _kill(worker, signal.SIGKILL)
+            os.waitpid(worker.pid, 0)
+            worker.pid = None
+
+def run(processes=None, port=None):
+    processes = processes or SERVER_PROCESSES
+    port = port or int(os.environ.get("PORT", 7005))
+    # Done once, before forking: the workers start with the migrated worlds and the preloaded static files
+    storage.migrate_json_worlds()
+    static_files.preload()
+    if jobs.JOB_STATE_DIR is None:
+        jobs.JOB_STATE_DIR = os.path.join(storage.DATA_DIR, ".jobs")
+    reuse_port = sys.platform.startswith("linux") and hasattr(socket, "SO_REUSEPORT")
+    try:
+        listener = _listen(port, reuse_port)
+    except OSError as e:
+        if e.errno == errno.EADDRINUSE:
+            print(f"Port {port} is already in use")
+        else:
+            print(f"Error starting server: {e}")
+        return 1
+
+    stopping = []
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: stopping.append(signum))
+    print(f"Server starting on http://localhost:{port} with {processes} processes "
+          f"({'SO_REUSEPORT' if reuse_port else 'shared socket'})")
+    workers = [Worker(i) for i in range(processes)]
+    for worker in workers:
+        _spawn(worker, port, listener, reuse_port)
+    next_check = time.monotonic() + HEALTH_CHECK_INTERVAL
+    while not stopping:
+        time.sleep(0.5)
+        _reap(workers, stopping=False)
+        for worker in workers:
+            if worker.pid is None and worker.restart_at is not None and time.monotonic() >= worker.restart_at and not stopping:
+                _spawn(worker, port, listener, reuse_port)
+        if time.monotonic() >= next_check:
+            _check_health(workers)
+            next_check = time.monotonic() + HEALTH_CHECK_INTERVAL
+    _stop(workers)
+    listener.close()
+    print("Server stopped.")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the server as several supervised processes")
+    parser.add_argument("--processes", type=int, help=f"worker processes (SERVER_PROCESSES, default {SERVER_PROCESSES})")
+    parser.add_argument("--port", type=int, help="port (PORT, default 7005)")
+    args = parser.parse_args()
+    sys.exit(run(args.processes, args.port))
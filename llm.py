@@ -0,0 +1,232 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from cerebras.cloud.sdk import APIConnectionError
+import metrics
+
+# Every Cerebras call goes through complete(), which keeps us inside the account's limits and copes with a
+# flaky or overloaded API:
+#   - token buckets cap requests per minute and (estimated) tokens per minute, waiting for capacity instead of getting 429s
+#   - at most LLM_MAX_CONCURRENCY calls run at once, the others queue; a call only takes its slot once the
+#     token buckets let it through, and gives it back while waiting to retry
+#   - connection errors, timeouts, 429s and 5xx are retried with exponential backoff and full jitter (honouring Retry-After)
+#   - each call has a deadline covering queueing, retries and the calls themselves
+#   - when a model keeps failing, or doesn't exist, the next one in LLM_FALLBACK_MODELS is tried
+# A streamed call can only be retried until its first chunk has arrived.
+
+LLM_MODEL = os.environ.get("LLM_MODEL", "qwen-3-235b-a22b-instruct-2507")
+LLM_FALLBACK_MODELS = [model for model in os.environ.get("LLM_FALLBACK_MODELS", "").split(",") if model]
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 8))
+LLM_REQUESTS_PER_MINUTE = float(os.environ.get("LLM_REQUESTS_PER_MINUTE", 0))  # 0 = no limit
+LLM_TOKENS_PER_MINUTE = float(os.environ.get("LLM_TOKENS_PER_MINUTE", 0))  # 0 = no limit
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 3))  # per model
+LLM_DEADLINE = float(os.environ.get("LLM_DEADLINE", 180))  # seconds for a whole call, retries included
+LLM_ATTEMPT_TIMEOUT = float(os.environ.get("LLM_ATTEMPT_TIMEOUT", 120))  # seconds for a single attempt
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 10
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+FALLBACK_STATUSES = {404}  # model not found: no use retrying, go straight to the next model
+CHARS_PER_TOKEN = 4
+
+class LLMError(Exception):
+    pass
+
+class LLMTimeout(LLMError):
+    """The call's deadline passed before it could be completed"""
+
+class TokenBucket:
+    """Holds up to `capacity` units, refilled at `rate` units per second"""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount, deadline):
+        """Take `amount` units, waiting for them if needed; returns the seconds waited"""
+        amount = min(amount, self.capacity)
+        start = time.monotonic()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.level >= amount:
+                    self.level -= amount
+                    return now - start
+                wait = (amount - self.level) / self.rate
+            if now + wait > deadline:
+                raise LLMTimeout("Rate limit wait would exceed the deadline")
+            time.sleep(wait)
+
+_request_bucket = TokenBucket(LLM_REQUESTS_PER_MINUTE / 60, max(LLM_REQUESTS_PER_MINUTE / 6, 1)) if LLM_REQUESTS_PER_MINUTE else None
+_token_bucket = TokenBucket(LLM_TOKENS_PER_MINUTE / 60, LLM_TOKENS_PER_MINUTE / 6) if LLM_TOKENS_PER_MINUTE else None
+_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+stats = metrics.Stats(calls=0, succeeded=0, failed=0, retries=0, fallbacks=0, rate_limited=0, timeouts=0,
+                      queued=0, running=0, queue_wait_seconds_total=0.0, queue_wait_seconds_max=0.0,
+                      throttle_wait_seconds_total=0.0)
+
+def get_stats():
+    return stats.snapshot(max_concurrency=LLM_MAX_CONCURRENCY)
+
+def _status(e):
+    return getattr(e, "status_code", None)
+
+def _retryable(e):
+    status = _status(e)
+    if status is not None:
+        return status in RETRY_STATUSES
+    return isinstance(e, (APIConnectionError, ConnectionError, TimeoutError))
+
+def _backoff(attempt, e):
+    """Seconds to wait before retry number `attempt` (1-based)"""
+    response = getattr(e, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def _acquire_slot(deadline):
+    stats.count("queued")
+    start = time.monotonic()
+    try:
+        if not _slots.acquire(timeout=max(deadline - start, 0)):
+            raise LLMTimeout("Timed out waiting for a free LLM slot")
+    finally:
+        stats.count("queued", -1)
+    stats.observe("queue_wait_seconds", time.monotonic() - start)
+    stats.count("running")
+
+def _release_slot():
+    stats.count("running", -1)
+    _slots.release()
+
+def _throttle(messages, deadline):
+    waited = 0.0
+    if _request_bucket is not None:
+        waited += _request_bucket.acquire(1, deadline)
+    if _token_bucket is not None:
+        waited += _token_bucket.acquire(sum(len(m["content"]) for m in messages) // CHARS_PER_TOKEN, deadline)
+    if waited:
+        stats.count("throttle_wait_seconds_total", waited)
+
+def _attempt(client, messages, model, stream, deadline):
+    """One call to the API, holding a concurrency slot while it runs
+
+    For streams, returns a _SlotHoldingStream that starts with the already received first chunk.
+    """
+    _throttle(messages, deadline)
+    _acquire_slot(deadline)
+    try:
+        timeout = min(LLM_ATTEMPT_TIMEOUT, deadline - time.monotonic())
+        if timeout <= 0:
+            raise LLMTimeout("LLM deadline passed")
+        response = client.chat.completions.create(messages=messages, model=model, stream=stream, timeout=timeout)
+        if stream:
+            chunks = iter(response)
+            first = next(chunks, None)
+    except BaseException:
+        _release_slot()
+        raise
+    if not stream:
+        _release_slot()
+        return response
+    return _SlotHoldingStream(chunks if first is None else _prepend(first, chunks))
+
+def _prepend(first, chunks):
+    yield first
+    yield from chunks
+
+def _call(client, messages, stream, deadline):
+    models = [LLM_MODEL] + [model for model in LLM_FALLBACK_MODELS if model != LLM_MODEL]
+    for model_index, model in enumerate(models):
+        attempt = 0
+        while True:
+            try:
+                return _attempt(client, messages, model, stream, deadline)
+            except LLMTimeout:
+                raise
+            except Exception as e:
+                if _status(e) == 429:
+                    stats.count("rate_limited")
+                last_model = model_index == len(models) - 1
+                if _status(e) in FALLBACK_STATUSES and not last_model:
+                    break
+                if not _retryable(e):
+                    raise
+                attempt += 1
+                if attempt > LLM_MAX_RETRIES:
+                    if last_model:
+                        raise
+                    break
+                delay = _backoff(attempt, e)
+                if time.monotonic() + delay >= deadline:
+                    raise LLMTimeout(f"LLM deadline passed while retrying after: {e}") from e
+                print(f"LLM call to {model} failed ({e}), retry {attempt} in {delay:.1f} s")
+                stats.count("retries")
+                time.sleep(delay)
+        print(f"Model {model} failed, falling back to {models[model_index + 1]}")
+        stats.count("fallbacks")
+
+def complete(client, messages, stream=False, deadline=None):
+    """client.chat.completions.create(messages, stream) with rate limiting, queueing, retries and fallback
+
+    deadline is in seconds from now (LLM_DEADLINE by default). Raises LLMTimeout when it passes, or the
+    client's last error when retrying or falling back can't help.
+    """
+    deadline = time.monotonic() + (deadline or LLM_DEADLINE)
+    stats.count("calls")
+    try:
+        response = _call(client, messages, stream, deadline)
+    except LLMTimeout:
+        stats.count("timeouts")
+        stats.count("failed")
+        raise
+    except Exception:
+        stats.count("failed")
+        raise
+    if not stream:
+        stats.count("succeeded")
+    return response  # a stream counts its own outcome when it ends
+
+class _SlotHoldingStream:
+    """Iterator over a streamed response that keeps its concurrency slot until it is read to the end, fails or is dropped"""
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.holding = True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.chunks)
+        except StopIteration:
+            self._release("succeeded")
+            raise
+        except Exception:
+            self._release("failed")
+            raise
+
+    def _release(self, outcome=None):
+        if self.holding:
+            self.holding = False
+            if outcome:
+                stats.count(outcome)
+            _release_slot()
+
+    def close(self):
+        self._release()
+
+    def __del__(self):
+        self._release()
+
+async def complete_async(client, messages, stream=False, deadline=None):
+    """complete() for asyncio code; runs on a worker thread so it shares the same limits as the synchronous callers"""
+    return await asyncio.to_thread(complete, client, messages, stream, deadline)
@@ -0,0 +1,181 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# Counters, gauges and histograms for /api/metrics, in the Prometheus text exposition format.
+# Every metric is created once at module level below and updated from wherever the work happens;
+# the stats other modules already keep (caches, locks, jobs...) are exported as gauges through register_stats.
+
+# Seconds; requests and storage are usually fast, LLM calls take seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+
+_metrics = []
+_stats_sources = []  # (prefix, function returning a dict of numbers)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}  # label values -> value
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"]
+
+class Counter(_Metric):
+    type = "counter"
+
+    def total(self):
+        """Sum over every combination of labels"""
+        with self._lock:
+            return sum(self._values.values())
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]  # per-bucket counts, sum, count
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_value(self, key, value):
+        with self._lock:
+            counts, total, count = list(value[0]), value[1], value[2]
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.label_names, key, [("le", _format_value(float(bound)))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', '+Inf')])} {count}")
+        lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+class Stats:
+    """A module's stats dict, updated from many threads: every update and every read holds the lock"""
+    def __init__(self, **values):
+        self._values = values
+        self._lock = threading.Lock()
+
+    def count(self, key, amount=1):
+        with self._lock:
+            self._values[key] += amount
+
+    def observe(self, prefix, value):
+        """Add value to <prefix>_total and raise <prefix>_max to it if it is larger"""
+        with self._lock:
+            self._values[prefix + "_total"] += value
+            self._values[prefix + "_max"] = max(self._values[prefix + "_max"], value)
+
+    def snapshot(self, **extra):
+        """A copy of the numbers, plus any extra ones"""
+        with self._lock:
+            return dict(self._values, **extra)
+
+def register_stats(prefix, source):
+    """Export the numbers in a stats dict (or returned by a function) as gauges named <prefix>_<key>"""
+    _stats_sources.append((prefix, source if callable(source) else lambda: source))
+
+def render():
+    """All metrics in the Prometheus text format"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for prefix, source in _stats_sources:
+        for key, value in sorted(source().items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"# TYPE {prefix}_{key} gauge")
+                lines.append(f"{prefix}_{key} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+http_requests_in_flight = Gauge("duo_http_requests_in_flight", "Requests being handled right now")
+http_request_duration = Histogram("duo_http_request_duration_seconds", "Time to handle a request, by route",
+                                  ["method", "route", "status"])
+http_requests_rejected = Counter("duo_http_requests_rejected_total", "Connections turned away with a 503 because every worker was busy")
+
+llm_request_duration = Histogram("duo_llm_request_duration_seconds", "Time for a whole Cerebras completion",
+                                 ["mode"], buckets=LLM_BUCKETS)
+llm_time_to_first_token = Histogram("duo_llm_time_to_first_token_seconds", "Time until the first streamed piece of a completion",
+                                    buckets=LLM_BUCKETS)
+llm_prompt_tokens = Counter("duo_llm_prompt_tokens_total", "Prompt tokens sent to Cerebras", ["world"])
+llm_completion_tokens = Counter("duo_llm_completion_tokens_total", "Completion tokens received from Cerebras", ["world"])
+llm_errors = Counter("duo_llm_errors_total", "Cerebras calls that raised", ["mode"])
+
+world_read_bytes = Counter("duo_world_read_bytes_total", "Bytes of world logs read from disk")
+world_write_bytes = Counter("duo_world_write_bytes_total", "Bytes of world logs written to disk", ["op"])
+world_read_duration = Histogram("duo_world_read_seconds", "Time to read and replay a world log")
+world_write_duration = Histogram("duo_world_write_seconds", "Time to write (and fsync) a world log record or file", ["op"])
+
+translate_request_duration = Histogram("duo_translate_request_duration_seconds", "Time for a call to the translate API",
+                                       ["outcome"])
@@ -0,0 +1,118 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import backend
+import metrics
+import storage
+from story_format import get_text
+
+# Speculative generation of the next scene. After a scene that doesn't end its story, schedule() starts
+# generating the following one in the background and keeps it as a draft, outside the world's log.
+# When the reader asks to continue, take() commits the draft instead of calling the LLM again,
+# unless the story changed since the draft was started, in which case the draft is thrown away.
+
+PREFETCH_ENABLED = os.environ.get("PREFETCH_NEXT_SCENE", "0") == "1"  # default for requests that don't say
+PREFETCH_WORKERS = int(os.environ.get("PREFETCH_WORKERS", 2))
+DRAFT_TTL = 600  # seconds an unused draft is kept
+
+class Draft:
+    def __init__(self, params, base_content, future):
+        self.params = params  # (prompt_base, language) the draft was generated with
+        self.base_content = base_content  # the story's content when generation started
+        self.future = future  # -> (completion, total tokens)
+        self.created = time.time()
+
+_drafts = {}  # (world name, story index) -> Draft
+_drafts_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+stats = metrics.Stats(scheduled=0, hits=0, misses=0, stale=0, failed=0, used_tokens=0, wasted_tokens=0)
+
+def get_stats():
+    return stats.snapshot()
+
+def _discard(draft):
+    """Count the tokens of a draft that will never be used (once it has finished generating)"""
+    def count_tokens(future):
+        if future.exception() is None:
+            stats.count("wasted_tokens", future.result()[1])
+    draft.future.add_done_callback(count_tokens)
+
+def _resolve_index(world, current_content_idx):
+    if current_content_idx == "new":
+        return len(world["backstory"]) - 1
+    idx = int(current_content_idx)
+    return len(world["backstory"]) + idx if idx < 0 else idx
+
+def schedule(prompt_base, topic, language, world_file, current_content_idx):
+    """Start generating the scene after the one just generated for this story, unless the story has ended"""
+    name = storage.world_name(world_file)
+    try:
+        if not storage.world_exists(name):
+            return
+        with storage.world_lock(name):
+            world = storage.load_world(name)
+            idx = _resolve_index(world, current_content_idx)
+            if not 0 <= idx < len(world["stories"]) or world["stories"][idx]["ended"]:
+                return
+            world, idx, prompt, prompt_tokens = backend.prepare_generation(prompt_base, topic, language, world_file, idx)
+    except Exception as e:
+        # Prefetching is only an optimization, never fail the request that triggered it
+        print(f"Error scheduling prefetch for {name}: {e}")
+        return
+
+    future = _executor.submit(backend.generate_completion, prompt, prompt_tokens, name)
+    draft = Draft((prompt_base, language), world["backstory"][idx], future)
+    now = time.time()
+    with _drafts_lock:
+        old = _drafts.pop((name, idx), None)
+        for key in [key for key, d in _drafts.items() if d.created + DRAFT_TTL < now]:
+            _discard(_drafts.pop(key))
+        _drafts[(name, idx)] = draft
+    if old is not None:
+        _discard(old)
+    stats.count("scheduled")
+
+def take(prompt_base, topic, language, world_file, current_content_idx):
+    """Commit the draft for this story if there is a usable one and return (story text, ended), otherwise None
+
+    If the draft is still being generated this waits for it, which is still sooner than starting over.
+    """
+    if current_content_idx == "new":
+        return None
+    name = storage.world_name(world_file)
+    if not storage.world_exists(name):
+        return None
+    idx = _resolve_index(storage.load_world(name), current_content_idx)
+    with _drafts_lock:
+        draft = _drafts.pop((name, idx), None)
+    if draft is None:
+        stats.count("misses")
+        return None
+    # The topic isn't compared: continue requests don't repeat the topic the story was started with
+    if draft.params != (prompt_base, language):
+        stats.count("misses")
+        _discard(draft)
+        return None
+    try:
+        completion, tokens = draft.future.result()
+    except Exception as e:
+        print(f"Error in prefetched generation for {name} story {idx}: {e}")
+        stats.count("failed")
+        return None
+
+    if not storage.world_exists(name):
+        # Deleted since the draft was scheduled
+        stats.count("stale")
+        stats.count("wasted_tokens", tokens)
+        return None
+    with storage.world_lock(name):
+        world = storage.load_world(name)
+        if idx >= len(world["backstory"]) or world["backstory"][idx] != draft.base_content:
+            stats.count("stale")
+            stats.count("wasted_tokens", tokens)
+            return None
+        backend.save_completion(world, world_file, idx, completion, language)
+    stats.count("hits")
+    stats.count("used_tokens", tokens)
+    return get_text(completion), completion.endswith("<end>")
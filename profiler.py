@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter, deque
+
+# Opt-in sampling profiler for slow requests. With PROFILE_SLOW_REQUESTS=<seconds> set, a background thread
+# takes the stack of every thread that is handling a request every PROFILE_INTERVAL seconds. When a request
+# takes longer than the threshold, its hottest stacks are printed and kept for /api/profile; samples of
+# fast requests are thrown away. Nothing is sampled while it is off (the default).
+
+SLOW_REQUEST_SECONDS = float(os.environ.get("PROFILE_SLOW_REQUESTS", 0))
+SAMPLE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.01))
+MAX_DEPTH = 40  # innermost frames kept per stack
+KEEP_PROFILES = 20  # slow requests kept for /api/profile
+TOP_STACKS = 10  # stacks kept per slow request
+
+_active = {}  # thread id -> Counter of stacks sampled while that thread handles its current request
+_active_lock = threading.Lock()
+_sampler = None
+_sampler_lock = threading.Lock()
+slow_requests = deque(maxlen=KEEP_PROFILES)
+
+def enabled():
+    return SLOW_REQUEST_SECONDS > 0
+
+def _stack(frame):
+    """Folded stack, outermost call first, e.g. "server.py:do_GET:120;backend.py:build_prompt:101" """
+    frames = []
+    while frame is not None and len(frames) < MAX_DEPTH:
+        code = frame.f_code
+        frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+def _sample_forever():
+    while True:
+        time.sleep(SAMPLE_INTERVAL)
+        with _active_lock:
+            if not _active:
+                continue
+            frames = sys._current_frames()
+            for thread_id, samples in _active.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    samples[_stack(frame)] += 1
+
+def _start_sampler():
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_forever, name="profiler", daemon=True)
+            _sampler.start()
+
+def start():
+    """Begin sampling the calling thread; returns a token for finish(), or None if profiling is off"""
+    if not enabled():
+        return None
+    _start_sampler()
+    thread_id = threading.get_ident()
+    with _active_lock:
+        _active[thread_id] = Counter()
+    return thread_id
+
+def finish(token, label, duration):
+    """Stop sampling; if the request was slow, keep and print its hottest stacks"""
+    if token is None:
+        return
+    with _active_lock:
+        samples = _active.pop(token, None)
+    if samples is None or duration < SLOW_REQUEST_SECONDS:
+        return
+    profile = {
+        "request": label,
+        "seconds": round(duration, 3),
+        "time": time.time(),
+        "samples": sum(samples.values()),
+        "stacks": [{"stack": stack, "samples": count} for stack, count in samples.most_common(TOP_STACKS)],
+    }
+    slow_requests.append(profile)
+    message = f"Slow request: {label} took {duration:.2f} s ({profile['samples']} samples)"
+    if profile["stacks"]:
+        message += f"\n  hottest stack ({profile['stacks'][0]['samples']} samples): {profile['stacks'][0]['stack']}"
+    print(message)
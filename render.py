@@ -0,0 +1,68 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import markdown
+import storage
+
+# Server-side markdown rendering, done once per version of a story's text. Rendered HTML is cached by
+# the SHA-1 of the markdown, so a story that gets a new scene simply gets a new hash; the cache entries
+# of a world are also dropped as soon as storage reports that the world changed.
+
+RENDER_CACHE_BYTES = int(os.environ.get("RENDER_CACHE_BYTES", 16 * 1024 * 1024))
+
+_html = OrderedDict()  # content hash -> html
+_html_bytes = 0
+_story_hashes = {}  # (world name, story index) -> content hash of the last rendered version
+_lock = threading.Lock()
+stats = {"hits": 0, "misses": 0, "evictions": 0}  # guarded by _lock
+
+def get_stats():
+    with _lock:
+        return dict(stats, entries=len(_html), bytes=_html_bytes)
+
+def content_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def _forget(key):
+    global _html_bytes
+    html = _html.pop(key, None)
+    if html is not None:
+        _html_bytes -= len(html)
+
+def render_markdown(text, key=None):
+    """HTML for markdown text; returns (html, content hash)"""
+    global _html_bytes
+    key = key or content_hash(text)
+    with _lock:
+        html = _html.get(key)
+        if html is not None:
+            _html.move_to_end(key)
+            stats["hits"] += 1
+            return html, key
+        stats["misses"] += 1
+    html = markdown.markdown(text)
+    with _lock:
+        if key not in _html:
+            _html[key] = html
+            _html_bytes += len(html)
+        while _html_bytes > RENDER_CACHE_BYTES and len(_html) > 1:
+            _forget(next(iter(_html)))
+            stats["evictions"] += 1
+    return html, key
+
+def render_story(world_name, story_index, text):
+    """render_markdown for a stored story, remembered so it can be dropped when the world changes"""
+    html, key = render_markdown(text)
+    with _lock:
+        _story_hashes[(world_name, story_index)] = key
+    return html, key
+
+def invalidate(world_name, story_index=None):
+    """Drop the rendered HTML of a story, or of every story in the world if story_index is None"""
+    with _lock:
+        for story_key in [story_key for story_key in _story_hashes
+                          if story_key[0] == world_name and story_index in (None, story_key[1])]:
+            _forget(_story_hashes.pop(story_key))
+
+storage.change_listeners.append(invalidate)
@@ -0,0 +1,159 @@
+import os
+import zlib
+
+# Framing and compression of the server's responses. While a request is handled, the handler's self.wfile is
+# a ResponseBody, so the handlers only write their body and never have to work out the framing:
+#   - a body that is complete when the handler returns goes out with a Content-Length, gzipped first if the
+#     client accepts gzip and it is at least GZIP_MIN_BYTES
+#   - once the handler calls flush(), the response is streamed instead: chunked (or, for an HTTP/1.0 client,
+#     ended by closing the connection), gzipped on the fly where accepted, with whatever was flushed decodable right away
+#   - a handler that sends its own Content-Length (e.g. for a static file) is passed through as is
+# With every response framed, connections can be kept alive between requests.
+
+GZIP_MIN_BYTES = int(os.environ.get("GZIP_MIN_BYTES", 1024))
+GZIP_LEVEL = 6
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/x-ndjson", "application/javascript", "image/svg+xml")
+NO_BODY_STATUSES = (204, 304)
+
+def _quality(params):
+    """The q value among an Accept-Encoding entry's parameters (1 if it has none, 0 if it can't be read)"""
+    for param in params.split(";"):
+        name, _, value = param.strip().partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value)
+            except ValueError:
+                return 0.0
+    return 1.0
+
+def accepts_encoding(accept_encoding, coding):
+    """Whether an Accept-Encoding header allows a content coding (q=0 refuses it; the coding's own entry wins over *)"""
+    allowed = False
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if name == coding:
+            return _quality(params) > 0
+        if name == "*":
+            allowed = _quality(params) > 0
+    return allowed
+
+def accepts_gzip(accept_encoding):
+    return accepts_encoding(accept_encoding, "gzip")
+
+def _gzip_compressor():
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # 16+: gzip header and trailer
+
+class ResponseBody:
+    """File-like response body of one request; the headers are held back until the framing is known"""
+    def __init__(self, handler, raw):
+        self.handler = handler
+        self.raw = raw  # the connection's own wfile
+        self.headers = {}  # lower-cased name -> value, of the headers the handler sent
+        self.buffer = []
+        self.pending = 0  # bytes buffered and not sent yet
+        self.headers_ended = False
+        self.committed = False  # headers sent
+        self.chunked = False
+        self.compressor = None
+        self.aborted = False
+
+    def header_sent(self, keyword, value):
+        self.headers[keyword.lower()] = value
+
+    def end_headers(self):
+        self.headers_ended = True
+        if "content-length" in self.headers or self.handler.response_status in NO_BODY_STATUSES:
+            self._commit([])
+
+    def _compressible(self):
+        content_type = self.headers.get("content-type", "")
+        return "content-encoding" not in self.headers and content_type.startswith(COMPRESSIBLE_TYPES)
+
+    def _gzip(self):
+        return self._compressible() and accepts_gzip(self.handler.headers.get("Accept-Encoding"))
+
+    def _commit(self, headers):
+        for keyword, value in headers:
+            self.handler.send_header(keyword, value)
+        self.handler._headers_buffer.append(b"\r\n")
+        self.raw.write(b"".join(self.handler._headers_buffer))
+        self.handler._headers_buffer = []
+        self.committed = True
+
+    def _send(self, data):
+        self._frame(self.compressor.compress(data) if self.compressor is not None else data)
+
+    def _frame(self, data):
+        if not data:
+            return  # an empty chunk would end the response
+        if self.chunked:
+            self.raw.write(b"%x\r\n%b\r\n" % (len(data), data))
+        else:
+            self.raw.write(data)
+
+    def write(self, data):
+        if self.aborted:
+            return 0
+        if self.committed:
+            self._send(data)
+        else:
+            self.buffer.append(bytes(data))
+            self.pending += len(data)
+        return len(data)
+
+    def flush(self):
+        """Send what has been written so far; the first call turns the response into a stream"""
+        if self.aborted or not self.headers_ended:
+            return
+        if not self.committed:
+            headers = [("Vary", "Accept-Encoding")] if self._compressible() else []
+            if self._gzip():
+                headers.append(("Content-Encoding", "gzip"))
+                self.compressor = _gzip_compressor()
+            if self.handler.request_version >= "HTTP/1.1":
+                headers.append(("Transfer-Encoding", "chunked"))
+                self.chunked = True
+            else:
+                headers.append(("Connection", "close"))
+            self._commit(headers)
+            self._send_buffer()
+        if self.compressor is not None:
+            self._frame(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+        self.raw.flush()
+
+    def _send_buffer(self):
+        data = b"".join(self.buffer)
+        self.buffer = []
+        self.pending = 0
+        self._send(data)
+
+    def close(self):
+        """The handler is done: send the rest of the response"""
+        if self.aborted:
+            return
+        if not self.headers_ended:
+            self.handler.close_connection = True  # nothing was sent, the client can only tell from the connection
+            return
+        if not self.committed:
+            body = b"".join(self.buffer)
+            headers = [("Vary", "Accept-Encoding")] if self._compressible() else []
+            if len(body) >= GZIP_MIN_BYTES and self._gzip():
+                compressor = _gzip_compressor()
+                body = compressor.compress(body) + compressor.flush()
+                headers.append(("Content-Encoding", "gzip"))
+            headers.append(("Content-Length", str(len(body))))
+            self._commit(headers)
+            if body:
+                self.raw.write(body)
+            return
+        if self.compressor is not None:
+            self._frame(self.compressor.flush())
+        if self.chunked:
+            self.raw.write(b"0\r\n\r\n")
+
+    def abort(self):
+        """Give up on the response (e.g. an error after streaming started): the connection is closed
+        without ending it properly, so the client can tell it is incomplete"""
+        self.aborted = True
+        self.handler.close_connection = True
@@ -0,0 +1,97 @@
+import os
+import re
+import math
+from collections import Counter
+import storage
+
+# TF-IDF index over the stories of each world, for putting the most relevant earlier stories into a prompt
+# instead of all of them. A story is represented by its scenes' <summary> and <info> blocks. Like vocab.py,
+# the index follows the world logs (storage.LogFollower), so adding a scene only indexes that scene.
+# The vectors are sparse dicts: worlds have tens to hundreds of stories, which plain Python scores in about a millisecond.
+
+RETRIEVAL_TOP_K = int(os.environ.get("PLOT_RETRIEVAL_TOP_K", 8))  # 0 = use the most recent stories instead
+
+WORD_RE = re.compile(r"[^\W\d_]{2,}")
+
+def tokenize(text):
+    return [word.casefold() for word in WORD_RE.findall(text)]
+
+class WorldPlots:
+    def __init__(self):
+        self.terms = {}  # story index -> Counter of terms
+        self.document_frequency = Counter()  # term -> stories using it
+        self.norms = None  # story index -> length of its tf-idf vector, computed when needed
+
+    def add(self, story, text):
+        counts = Counter(tokenize(text))
+        if not counts:
+            return
+        story_terms = self.terms.setdefault(story, Counter())
+        self.document_frequency.update(counts.keys() - story_terms.keys())
+        story_terms.update(counts)
+        self.norms = None
+
+    def idf(self, term):
+        return math.log((1 + len(self.terms)) / (1 + self.document_frequency[term])) + 1
+
+    def _weights(self, counts):
+        return {term: (1 + math.log(count)) * self.idf(term) for term, count in counts.items()}
+
+    def rank(self, query, exclude=()):
+        """Story indexes by cosine similarity to the query text, most similar first; ties go to the more recent story"""
+        if self.norms is None:
+            self.norms = {story: math.sqrt(sum(w * w for w in self._weights(counts).values()))
+                          for story, counts in self.terms.items()}
+        query_weights = self._weights(Counter(term for term in tokenize(query) if term in self.document_frequency))
+        query_norm = math.sqrt(sum(w * w for w in query_weights.values())) or 1.0
+        scores = {}
+        for story, counts in self.terms.items():
+            if story in exclude:
+                continue
+            dot = sum(weight * (1 + math.log(counts[term])) * self.idf(term)
+                      for term, weight in query_weights.items() if term in counts)
+            scores[story] = dot / (query_norm * self.norms[story]) if self.norms[story] else 0.0
+        return sorted(scores, key=lambda story: (scores[story], story), reverse=True)
+
+_worlds = {}  # world name -> WorldPlots
+stats = {"queries": 0, "scenes_indexed": 0, "worlds_reset": 0}
+
+def _reset_world(name):
+    _worlds.pop(name, None)
+    stats["worlds_reset"] += 1
+
+def _apply(name, record):
+    plots = _worlds.setdefault(name, WorldPlots())
+    op = record.get("op")
+    if op == "create":
+        for i, story in enumerate(record.get("stories") or []):
+            plots.add(i, story.get("summary", "") + "\n" + story.get("info", ""))
+            stats["scenes_indexed"] += 1
+    elif op == "append":
+        fields = record.get("fields") or storage.extract_fields(record["text"])
+        plots.add(record["story"], fields["summary"] + "\n" + fields["info"])
+        stats["scenes_indexed"] += 1
+    elif op == "clear":
+        _worlds[name] = WorldPlots()
+
+_follower = storage.LogFollower(_reset_world, _apply)
+
+def _on_change(name, story_idx):
+    try:
+        _follower.refresh(name)
+    except Exception as e:
+        print(f"Error updating the plot index for {name}: {e}")
+
+storage.change_listeners.append(_on_change)
+
+def rank_stories(world_name, query, exclude=()):
+    """Indexes of the world's stories, most relevant to the query first"""
+    _follower.refresh(world_name)
+    with _follower.lock:
+        stats["queries"] += 1
+        plots = _worlds.get(world_name)
+        return plots.rank(query, set(exclude)) if plots is not None else []
+
+def get_stats():
+    with _follower.lock:
+        return dict(stats, worlds=len(_worlds), stories=sum(len(plots.terms) for plots in _worlds.values()))
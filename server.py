@@ -1,32 +1,217 @@
 import http.server
-import socketserver
 import backend
-import markdown
+import storage
+import translate
+import jobs
+import prefetch
+import static_files
+import render
+import vocab
+import retrieval
+import llm
+import metrics
+import profiler
+import responses
 import traceback
+import time
+import itertools
+import hashlib
+import queue
 import os
+import errno
+import socket
+import signal
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse, parse_qs
+from email.utils import formatdate
+
+def story_listing(world_name, story_index, story, include_content=True):
+    """Entry for a story in the /api/get_all_stories and /api/get_story responses, or None if it has no text yet"""
+    story_content = story['text']
+    if not story_content.strip():
+        return None
+    # Extract title from the story content if it has one
+    title = f"Story {story_index+1}"
+    if story_content.startswith('# '):
+        first_line = story_content.split('\n')[0]
+        title = first_line.replace('# ', '').strip()
+
+    # Create a preview (first 200 characters)
+    preview = story_content.replace('\n', ' ').strip()
+    if len(preview) > 200:
+        preview = preview[:200] + "..."
+
+    listing = {
+        "id": f"{world_name}_{story_index}",
+        "title": title,
+        "preview": preview,
+        "story_index": story_index
+    }
+    if include_content:
+        listing["content"] = story_content
+        listing["html"], listing["content_hash"] = render.render_story(world_name, story_index, story_content)
+    return listing
+
+def translation_response(text, result, source_lang, target_lang):
+    """Response body for one translation, from the translate API's result"""
+    return {
+        "success": True,
+        "original_text": text,
+        "translated_text": result.get('destination-text', ''),
+        "source_language": result.get('source-language', source_lang),
+        "target_language": target_lang,
+        "pronunciation": result.get('pronunciation', {}),
+        "additional_translations": result.get('translations', {}).get('possible-translations', [])
+    }
+
+def generation_params(data):
+    """Arguments for backend.generate_content from a generate request's JSON body"""
+    topic = data.get('topic', 'default topic')
+    language = data.get('language', 'English')
+    format_index = int(data.get('format', '0'))  # Default to 0 (play script)
+    world_file = data.get('world_file', 'data/world0.json')
+    current_content_idx = data.get('current_content_idx', 'new')
+
+    # Select prompt base based on format: 0 = play script, 1 = short story
+    if format_index == 1:
+        prompt_base = backend.prompt_bases[1]  # Short story
+    else:
+        prompt_base = backend.prompt_bases[0]  # Play script (default)
+    return prompt_base, topic, language, world_file, current_content_idx
+
+STREAM_FLUSH_BYTES = 64 * 1024  # a streamed listing is sent whenever this much is ready
+
+def library_json(world_names, list_only, total_worlds, offset, limit):
+    """The /api/get_all_stories response as pieces of JSON text, one world at a time, so only one world
+    is in memory at once and the first worlds can be sent while the others are still being read"""
+    import json
+    yield '{"success": true, "worlds": ['
+    total_count = 0
+    separator = ''
+    for world_name in world_names:
+        try:
+            world_data = storage.load_world(world_name)
+            stories = []
+            for i, story in enumerate(world_data['stories']):
+                listing = story_listing(world_name, i, story, include_content=not list_only)
+                if listing:  # Only include non-empty stories
+                    stories.append(listing)
+            world = {"name": world_name, "description": world_data.get('description', 'No description'), "stories": stories}
+        except Exception as e:
+            print(f"Error reading world {world_name}: {e}")
+            continue
+        total_count += len(stories)
+        yield separator + json.dumps(world)
+        separator = ', '
+    yield '], ' + json.dumps({"total_count": total_count, "total_worlds": total_worlds, "offset": offset, "limit": limit})[1:]
+
+# The stats shown by /api/status are exported by /api/metrics too
+metrics.register_stats("duo_world_cache", storage.get_cache_stats)
+metrics.register_stats("duo_world_locks", storage.get_lock_stats)
+metrics.register_stats("duo_translation_cache", translate.get_stats)
+metrics.register_stats("duo_jobs", jobs.get_stats)
+metrics.register_stats("duo_prefetch", prefetch.get_stats)
+metrics.register_stats("duo_render_cache", render.get_stats)
+metrics.register_stats("duo_llm_gateway", llm.get_stats)
+metrics.register_stats("duo_vocabulary", vocab.get_stats)
+metrics.register_stats("duo_plot_retrieval", retrieval.get_stats)
+
+# Routes get their own latency series in /api/metrics; everything else is counted under "other"
+ROUTES = {
+    'GET': {'/', '/hello', '/api/status', '/api/metrics', '/api/profile', '/api/echo', '/api/get_all_stories',
+            '/api/jobs', '/api/jobs/stats', '/api/get_story', '/api/worlds/export', '/api/vocabulary',
+            '/api/vocabulary/word'},
+    'POST': {'/api/data', '/api/generate_story', '/api/generate_story_stream', '/api/jobs/generate_story',
+             '/api/clear_worlds', '/api/translate', '/api/translate_batch', '/api/create_world', '/api/delete_world',
+             '/api/worlds/clear', '/api/worlds/delete', '/api/worlds/import', '/api/vocabulary/analyze'},
+}
+
+def route_label(method, path):
+    if path.startswith('/static/'):
+        return '/static/'
+    return path if path in ROUTES.get(method, ()) else 'other'
+
+KEEPALIVE_TIMEOUT = float(os.environ.get("SERVER_KEEPALIVE_TIMEOUT", 5))  # seconds an idle connection is kept open
+REQUEST_TIMEOUT = float(os.environ.get("SERVER_REQUEST_TIMEOUT", 30))  # seconds any one read or write of a request may block
 
 class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+    # Every response is framed (see responses.py), so connections can be reused
+    protocol_version = "HTTP/1.1"
+    timeout = REQUEST_TIMEOUT  # socket timeout, so a client that stops sending or reading can't hold a worker forever
+    response_body = None  # the responses.ResponseBody of the request being handled
+
+    def handle_one_request(self):
+        # Until a request starts arriving (the first one included), the connection holds one of the server's workers
+        # for nothing: give up on it after KEEPALIVE_TIMEOUT, or as soon as the server stops
+        self.connection.settimeout(KEEPALIVE_TIMEOUT)
+        try:
+            with self.server.idle(self.connection):
+                waiting = self.rfile.peek(1)
+        except OSError:
+            waiting = b''
+        if not waiting:
+            self.close_connection = True
+            return
+        self.connection.settimeout(self.timeout)
+        super().handle_one_request()
+
     def do_GET(self):
+        self.instrumented(self.handle_get)
+
+    def do_POST(self):
+        self.instrumented(self.handle_post)
+
+    def instrumented(self, handler):
+        """Run a request handler with its response framed by responses.ResponseBody, recording its latency and
+        status (and profiling it if that is enabled)"""
+        route = route_label(self.command, urlparse(self.path).path)
+        self.response_status = None
+        metrics.http_requests_in_flight.inc()
+        token = profiler.start()
+        start = time.perf_counter()
+        self.response_body = self.wfile = responses.ResponseBody(self, self.wfile)
+        try:
+            handler()
+            self.response_body.close()
+        except Exception:
+            self.response_body.abort()
+            raise
+        finally:
+            self.wfile = self.response_body.raw
+            self.response_body = None
+            duration = time.perf_counter() - start
+            profiler.finish(token, f"{self.command} {self.path}", duration)
+            metrics.http_requests_in_flight.dec()
+            metrics.http_request_duration.observe(duration, method=self.command, route=route,
+                                                  status=self.response_status or 'none')
+
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+
+    def send_header(self, keyword, value):
+        if self.response_body is not None:
+            self.response_body.header_sent(keyword, value)
+        super().send_header(keyword, value)
+
+    def end_headers(self):
+        if self.response_body is not None:
+            self.response_body.end_headers()  # sent once the framing is known
+        else:
+            super().end_headers()
+
+    def handle_get(self):
         # Parse the URL and query parameters
         parsed_path = urlparse(self.path)
         query_params = parse_qs(parsed_path.query)
 
         # Serve static files from /static/
         if parsed_path.path.startswith('/static/'):
-            static_file_path = os.path.join(os.getcwd(), parsed_path.path.lstrip('/'))
-            if os.path.isfile(static_file_path):
-                self.send_response(200)
-                # Set correct content type for PNG
-                if static_file_path.endswith('.png'):
-                    self.send_header('Content-type', 'image/png')
-                elif static_file_path.endswith('.jpg') or static_file_path.endswith('.jpeg'):
-                    self.send_header('Content-type', 'image/jpeg')
-                else:
-                    self.send_header('Content-type', 'application/octet-stream')
-                self.end_headers()
-                with open(static_file_path, 'rb') as f:
-                    self.wfile.write(f.read())
+            asset = static_files.get_static(parsed_path.path)
+            if asset is not None:
+                self.send_asset(asset)
             else:
                 self.send_response(404)
                 self.send_header('Content-type', 'text/html')
@@ -36,15 +221,13 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
 
         # Handle different routes
         if parsed_path.path == '/':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            # Read and serve the duo.html file
-            try:
-                with open('duo.html', 'r', encoding='utf-8') as file:
-                    html_content = file.read()
-                self.wfile.write(html_content.encode('utf-8'))
-            except FileNotFoundError:
+            asset = static_files.get_index()
+            if asset is not None:
+                self.send_asset(asset)
+            else:
+                self.send_response(200)
+                self.send_header('Content-type', 'text/html')
+                self.end_headers()
                 error_html = """
                 <!DOCTYPE html>
                 <html>
@@ -69,8 +252,34 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
             self.end_headers()
-            response = '{"status": "running", "message": "Server is healthy"}'
-            self.wfile.write(response.encode('utf-8'))
+            import json
+            response = {"status": "running", "message": "Server is healthy", "pid": os.getpid(),
+                        "world_cache": storage.get_cache_stats(),
+                        "translation_cache": translate.get_stats(), "world_locks": storage.get_lock_stats(),
+                        "jobs": jobs.get_stats(),
+                        "prefetch": prefetch.get_stats(),
+                        "render_cache": render.get_stats(),
+                        "llm": llm.get_stats(),
+                        "vocabulary": vocab.get_stats(),
+                        "plot_retrieval": retrieval.get_stats()}
+            self.wfile.write(json.dumps(response).encode('utf-8'))
+
+        elif parsed_path.path == '/api/metrics':
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.end_headers()
+            self.wfile.write(body)
+
+        elif parsed_path.path == '/api/profile':
+            # Hottest stacks of the last slow requests, see profiler.py (empty unless PROFILE_SLOW_REQUESTS is set)
+            import json
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            response = {"enabled": profiler.enabled(), "threshold_seconds": profiler.SLOW_REQUEST_SECONDS,
+                        "slow_requests": list(profiler.slow_requests)}
+            self.wfile.write(json.dumps(response).encode('utf-8'))
 
         elif parsed_path.path == '/api/echo':
             message = query_params.get('message', ['No message provided'])[0]
@@ -81,67 +290,41 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
             self.wfile.write(response.encode('utf-8'))
 
         elif parsed_path.path == '/api/get_all_stories':
+            # Query parameters (all optional):
+            #   mode=list        only titles and previews, fetch content per story from /api/get_story
+            #   world=<name>     only this world
+            #   offset, limit    page through the worlds
             import json
-            import glob
+            list_only = query_params.get('mode', ['full'])[0] == 'list'
+            world_filter = query_params.get('world', [None])[0]
             try:
-                # Find all world files
-                world_files = glob.glob('data/*.json')
-                worlds = []
-                
-                for world_file in world_files:
-                    try:
-                        with open(world_file, 'r') as f:
-                            world_data = json.load(f)
-                        
-                        world_name = os.path.basename(world_file).replace('.json', '')
-                        world_description = world_data.get('description', 'No description')
-                        backstory = world_data.get('backstory', [])
-                        
-                        # Create stories array for this world
-                        stories = []
-                        for i, story_content in enumerate(backstory):
-                            story_content = backend.get_text(story_content)
-                            if story_content.strip():  # Only include non-empty stories
-                                # Extract title from the story content if it has one
-                                title = f"Story {i+1}"
-                                if story_content.startswith('# '):
-                                    first_line = story_content.split('\n')[0]
-                                    title = first_line.replace('# ', '').strip()
-                                
-                                # Create a preview (first 200 characters)
-                                preview = story_content.replace('\n', ' ').strip()
-                                if len(preview) > 200:
-                                    preview = preview[:200] + "..."
-                                
-                                stories.append({
-                                    "id": f"{world_name}_{i}",
-                                    "title": title,
-                                    "preview": preview,
-                                    "content": story_content,
-                                    "story_index": i
-                                })
-                        
-                        # Add world object with its stories
-                        worlds.append({
-                            "name": world_name,
-                            "description": world_description,
-                            "stories": stories
-                        })
-                        
-                    except Exception as e:
-                        print(f"Error reading world file {world_file}: {e}")
-                        continue
-                
-                self.send_response(200)
+                offset = max(int(query_params.get('offset', ['0'])[0]), 0)
+                limit = query_params.get('limit', [None])[0]
+                limit = int(limit) if limit is not None else None
+                if limit is not None and limit < 0:
+                    raise ValueError(f"limit must not be negative: {limit}")
+            except ValueError as e:
+                self.send_response(400)
                 self.send_header('Content-type', 'application/json')
                 self.end_headers()
-                response = {
-                    "success": True,
-                    "worlds": worlds,
-                    "total_count": sum(len(world["stories"]) for world in worlds)
-                }
-                self.wfile.write(json.dumps(response).encode('utf-8'))
-                
+                self.wfile.write(json.dumps({"success": False, "error": str(e)}).encode('utf-8'))
+                return
+
+            try:
+                # Nothing is parsed if the client already has this version of the library
+                stamp, last_modified = storage.library_stamp()
+                etag = '"' + hashlib.sha1((stamp + '?' + parsed_path.query).encode('utf-8')).hexdigest() + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+
+                world_names = storage.list_worlds()
+                if world_filter is not None:
+                    world_names = [name for name in world_names if name == world_filter]
+                total_worlds = len(world_names)
+                world_names = world_names[offset:offset + limit if limit is not None else None]
             except Exception as e:
                 print(traceback.format_exc())
                 print("Error getting stories:", e)
@@ -150,6 +333,141 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                 self.end_headers()
                 response = {"success": False, "error": str(e)}
                 self.wfile.write(json.dumps(response).encode('utf-8'))
+                return
+
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', formatdate(last_modified, usegmt=True))
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            # A small library still goes out in one piece (with a Content-Length); a big one is streamed
+            try:
+                for piece in library_json(world_names, list_only, total_worlds, offset, limit):
+                    self.wfile.write(piece.encode('utf-8'))
+                    if self.wfile.pending >= STREAM_FLUSH_BYTES:
+                        self.wfile.flush()
+            except Exception as e:
+                print(traceback.format_exc())
+                print("Error streaming stories:", e)
+                self.wfile.abort()
+
+        elif parsed_path.path == '/api/jobs':
+            # Status of a generation job; with wait=<seconds> the request blocks until the job finishes (or the wait runs out)
+            import json
+            job_id = query_params.get('id', [''])[0]
+            try:
+                wait = min(float(query_params.get('wait', ['0'])[0]), 60)
+            except ValueError:
+                wait = 0
+            job = jobs.get_job(job_id, wait)
+            if job is None:
+                self.send_response(404)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({"success": False, "error": f"Job '{job_id}' not found"}).encode('utf-8'))
+                return
+            response = dict(job.to_dict(), success=True)
+            if job.status == "done":
+                response["html"] = render.render_markdown(job.story)[0]
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps(response).encode('utf-8'))
+
+        elif parsed_path.path == '/api/jobs/stats':
+            import json
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps(jobs.get_stats()).encode('utf-8'))
+
+        elif parsed_path.path == '/api/get_story':
+            # Full content of one story, by id ("<world>_<index>") or by world and index
+            import json
+            try:
+                story_id = query_params.get('id', [None])[0]
+                if story_id is not None:
+                    world_name, _, story_index = story_id.rpartition('_')
+                else:
+                    world_name = query_params.get('world', [''])[0]
+                    story_index = query_params.get('index', [''])[0]
+                storage.check_world_name(world_name)
+                story_index = int(story_index)
+                if not storage.world_exists(world_name):
+                    raise LookupError(f"World '{world_name}' does not exist")
+
+                etag = '"' + hashlib.sha1(f"{world_name}:{story_index}:{storage.world_stamp(world_name)}".encode('utf-8')).hexdigest() + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+
+                world_data = storage.load_world(world_name)
+                stories = world_data['stories']
+                listing = story_listing(world_name, story_index, stories[story_index]) if 0 <= story_index < len(stories) else None
+                if not listing:
+                    raise LookupError(f"Story {story_index} of world '{world_name}' does not exist")
+
+                self.send_response(200)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                self.wfile.write(json.dumps({"success": True, "world": world_name, "story": listing}).encode('utf-8'))
+
+            except (LookupError, ValueError) as e:
+                self.send_response(404 if isinstance(e, LookupError) else 400)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({"success": False, "error": str(e)}).encode('utf-8'))
+            except Exception as e:
+                print(traceback.format_exc())
+                print("Error getting story:", e)
+                self.send_response(500)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                response = {"success": False, "error": str(e)}
+                self.wfile.write(json.dumps(response).encode('utf-8'))
+
+        elif parsed_path.path in ('/api/vocabulary', '/api/vocabulary/word'):
+            # /api/vocabulary?world=<name>&story=<index>[&scene=-1][&scope=story|world|language][&top=20]:
+            #     how many words of a scene are new to the reader, see vocab.analyze_scene
+            # /api/vocabulary/word?word=<word>&language=<language>: its frequency rank and where it occurs
+            import json
+            try:
+                if parsed_path.path == '/api/vocabulary':
+                    response = vocab.analyze_scene(
+                        query_params.get('world', [''])[0],
+                        int(query_params.get('story', [''])[0]),
+                        int(query_params.get('scene', ['-1'])[0]),
+                        query_params.get('scope', ['world'])[0],
+                        int(query_params.get('top', ['20'])[0]))
+                else:
+                    response = vocab.word_locations(query_params.get('word', [''])[0], query_params.get('language', [''])[0])
+                self.send_response(200)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps(dict(response, success=True)).encode('utf-8'))
+            except (LookupError, ValueError) as e:
+                self.send_response(404 if isinstance(e, LookupError) else 400)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({"success": False, "error": str(e)}).encode('utf-8'))
+            except Exception as e:
+                print(traceback.format_exc())
+                print("Error analyzing vocabulary:", e)
+                self.send_response(500)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({"success": False, "error": str(e)}).encode('utf-8'))
+
+        elif parsed_path.path == '/api/worlds/export':
+            # Every world (or ?names=a,b) as newline-delimited JSON, one world per line; POST it to /api/worlds/import to restore
+            names = query_params.get('names', [None])[0]
+            self.send_ndjson(storage.export_worlds(names.split(',') if names else None),
+                             {'Content-Disposition': 'attachment; filename="worlds.ndjson"'})
 
         else:
             # Handle 404 for unknown paths
@@ -158,11 +476,106 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
             self.end_headers()
             self.wfile.write(b'<h1>404 - Page Not Found</h1>')
 
-    def do_POST(self):
+    def send_ndjson(self, items, headers=None):
+        """Stream items from a generator as newline-delimited JSON.
+
+        Nothing is sent until the first item is ready, so errors raised before it (e.g. validation) still get
+        a 400 response. The generator is always run to the end, even if the client goes away.
+        """
+        import json
+        try:
+            first = next(items, None)
+        except (ValueError, LookupError) as e:
+            self.send_response(400)
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps({"success": False, "error": str(e)}).encode('utf-8'))
+            return
+        except Exception as e:
+            print(traceback.format_exc())
+            self.send_response(500)
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps({"success": False, "error": str(e)}).encode('utf-8'))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-type', 'application/x-ndjson')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Accel-Buffering', 'no')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        client_connected = True
+        try:
+            for item in itertools.chain([first] if first is not None else [], items):
+                if not client_connected:
+                    continue
+                try:
+                    self.wfile.write((json.dumps(item) + '\n').encode('utf-8'))
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    client_connected = False
+        except Exception as e:
+            print(traceback.format_exc())
+            print("Error streaming items:", e)
+            self.wfile.abort()  # so the client can tell the response is incomplete
+
+    def send_batch(self, operation, *args):
+        """Run a storage bulk operation, then send its progress events as newline-delimited JSON followed by
+        {"success": true}. The batch is finished, and its worlds unlocked, before anything is sent, so a slow
+        client can't hold the locks. Invalid requests get a 400; a batch that failed (and was rolled back) a 500."""
+        import json
+        try:
+            events = operation(*args)
+        except (ValueError, LookupError) as e:
+            self.send_response(400)
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps({"success": False, "error": str(e)}).encode('utf-8'))
+            return
+        except Exception as e:
+            print(traceback.format_exc())
+            self.send_response(500)
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps({"success": False, "error": str(e)}).encode('utf-8'))
+            return
+        self.send_ndjson(iter(events + [{"success": True}]))
+
+    def send_asset(self, asset):
+        """Send a static_files.Asset, or 304 if the client's copy is current"""
+        if self.headers.get('If-None-Match') == asset.etag:
+            self.send_response(304)
+            self.send_header('ETag', asset.etag)
+            self.send_header('Cache-Control', asset.cache_control)
+            self.end_headers()
+            return
+        encoding = asset.choose_encoding(self.headers.get('Accept-Encoding'))
+        body = asset.encodings[encoding] if encoding else asset.body
+        self.send_response(200)
+        self.send_header('Content-type', asset.content_type)
+        self.send_header('Content-Length', str(len(body) if body is not None else asset.size))
+        self.send_header('ETag', asset.etag)
+        self.send_header('Cache-Control', asset.cache_control)
+        if asset.encodings:
+            self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(body)
+        else:
+            with open(asset.path, 'rb') as f:
+                self.wfile.flush()
+                self.connection.sendfile(f)
+
+    def handle_post(self):
         # Handle POST requests
         content_length = int(self.headers.get('Content-Length', 0))
         post_data = self.rfile.read(content_length)
-        print(self.path)
+        if self.headers.get('Transfer-Encoding'):
+            self.close_connection = True  # a body we don't read by Content-Length would be taken for the next request
         if self.path == '/api/data':
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
@@ -173,25 +586,23 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
             import json
             try:
                 data = json.loads(post_data)
-                topic = data.get('topic', 'default topic')
-                language = data.get('language', 'English')
-                format_index = int(data.get('format', '0'))  # Default to 0 (play script)
-                world_file = data.get('world_file', 'data/world0.json')
-                current_content_idx = data.get('current_content_idx', 'new')
-                
-                # Select prompt base based on format: 0 = play script, 1 = short story
-                if format_index == 1:
-                    prompt_base = backend.prompt_bases[1]  # Short story
-                else:
-                    prompt_base = backend.prompt_bases[0]  # Play script (default)
-                story, ended = backend.generate_content(prompt_base, topic, language, world_file, current_content_idx)
+                params = generation_params(data)
+                use_prefetch = data.get('prefetch', prefetch.PREFETCH_ENABLED)
+                result = prefetch.take(*params) if use_prefetch else None
+                story, ended = result or backend.generate_content(*params)
+                if use_prefetch and not ended:
+                    prefetch.schedule(*params)
                 response = {"story": story, "ended": ended}
                 self.send_response(200)
                 self.send_header('Content-type', 'text/html')
                 self.end_headers()
-                self.wfile.write(markdown.markdown(story).encode('utf-8'))
-                # print(story)
-                #self.wfile.write(markdown.markdown(story.encode('utf-8')))
+                self.wfile.write(render.render_markdown(story)[0].encode('utf-8'))
+            except llm.LLMTimeout as e:
+                print("Story generation timed out:", e)
+                self.send_response(504)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({"error": str(e)}).encode('utf-8'))
             except Exception as e:
                 print(traceback.format_exc())
                 print("Error generating story:", e)
@@ -199,19 +610,92 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                 self.send_header('Content-type', 'application/json')
                 self.end_headers()
                 self.wfile.write(json.dumps({"error": str(e)}).encode('utf-8'))
+        elif self.path == '/api/generate_story_stream':
+            # Same request body as /api/generate_story, but the scene text is sent as it is generated
+            import json
+            try:
+                data = json.loads(post_data)
+                params = generation_params(data)
+                use_prefetch = data.get('prefetch', prefetch.PREFETCH_ENABLED)
+                result = prefetch.take(*params) if use_prefetch else None
+                if result is not None:
+                    # The scene was already generated in the background, send it all at once
+                    chunks = iter([])
+                    first_chunk = result[0]
+                else:
+                    chunks = backend.generate_content_stream(*params)
+                    first_chunk = next(chunks, '')
+            except llm.LLMTimeout as e:
+                print("Story generation timed out:", e)
+                self.send_response(504)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({"error": str(e)}).encode('utf-8'))
+                return
+            except Exception as e:
+                print(traceback.format_exc())
+                print("Error generating story:", e)
+                self.send_response(500)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({"error": str(e)}).encode('utf-8'))
+                return
+
+            self.send_response(200)
+            self.send_header('Content-type', 'text/plain; charset=utf-8')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('X-Accel-Buffering', 'no')
+            self.end_headers()
+            # No lock is held here (see backend.generate_content_stream), so a slow reader only holds up this worker,
+            # for at most the socket timeout per write
+            client_connected = True
+            try:
+                for chunk in itertools.chain([first_chunk], chunks):
+                    if not client_connected or not chunk:
+                        continue  # read to the end, so a graceful shutdown still waits for the scene to be saved
+                    try:
+                        self.wfile.write(chunk.encode('utf-8'))
+                        self.wfile.flush()
+                    except OSError:
+                        # Gone, or stopped reading for longer than the timeout: the response can't be finished
+                        client_connected = False
+                        self.wfile.abort()
+            except Exception as e:
+                # Headers are already sent, so all we can do is log and close the connection
+                print(traceback.format_exc())
+                print("Error streaming story:", e)
+                self.wfile.abort()
+                return
+            if use_prefetch:
+                # Skipped if the story just ended
+                prefetch.schedule(*params)
+        elif self.path == '/api/jobs/generate_story':
+            # Same request body as /api/generate_story; poll /api/jobs?id=<job_id> for the result
+            import json
+            try:
+                data = json.loads(post_data)
+                job = jobs.submit(*generation_params(data))
+                self.send_response(202)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({"success": True, "job_id": job.id, "status": job.status}).encode('utf-8'))
+            except queue.Full:
+                self.send_response(503)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Retry-After', '5')
+                self.end_headers()
+                self.wfile.write(json.dumps({"success": False, "error": "Too many stories are being generated, try again later"}).encode('utf-8'))
+            except Exception as e:
+                print(traceback.format_exc())
+                print("Error submitting generation job:", e)
+                self.send_response(500)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({"success": False, "error": str(e)}).encode('utf-8'))
         elif self.path == '/api/clear_worlds':
             import json
-            import glob
             try:
-                # Find all JSON files in the data directory
-                world_files = glob.glob('data/*.json')
-                cleared_worlds = []
-                
-                for world_file in world_files:
-                    # Extract world name from file path (e.g., 'data/world0.json' -> 'world0')
-                    world_name = os.path.basename(world_file).replace('.json', '')
-                    backend.clear_world(world_name)
-                    cleared_worlds.append(world_name)
+                cleared_worlds = sorted(event["world"] for event in storage.clear_worlds())
                 
                 self.send_response(200)
                 self.send_header('Content-type', 'application/json')
@@ -242,43 +726,13 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                 if not text.strip():
                     raise ValueError("No text provided for translation")
                 
-                # Use Free Translate API from ftapi.pythonanywhere.com
-                base_url = "https://ftapi.pythonanywhere.com/translate"
-                
-                # Build URL parameters - use auto-detect if source is 'auto'
-                import urllib.parse
-                encoded_text = urllib.parse.quote(text)
-                if source_lang == 'auto':
-                    # Use the auto-detect method (second way - only dl and text)
-                    url = f"{base_url}?dl={target_lang}&text={encoded_text}"
-                else:
-                    # Use the explicit source language method (first way - sl, dl, and text)
-                    url = f"{base_url}?sl={source_lang}&dl={target_lang}&text={encoded_text}"
-                
-                # Make request to Free Translate API
-                response = requests.get(url, timeout=15)
+                result = translate.translate(text, source_lang, target_lang)
                 
-                if response.status_code == 200:
-                    result = response.json()
-                    translated_text = result.get('destination-text', '')
-                    detected_source = result.get('source-language', source_lang)
-                    
-                    self.send_response(200)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    
-                    response_data = {
-                        "success": True,
-                        "original_text": text,
-                        "translated_text": translated_text,
-                        "source_language": detected_source,
-                        "target_language": target_lang,
-                        "pronunciation": result.get('pronunciation', {}),
-                        "additional_translations": result.get('translations', {}).get('possible-translations', [])
-                    }
-                    self.wfile.write(json.dumps(response_data).encode('utf-8'))
-                else:
-                    raise Exception(f"Translation API returned status {response.status_code}: {response.text}")
+                self.send_response(200)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                response_data = translation_response(text, result, source_lang, target_lang)
+                self.wfile.write(json.dumps(response_data).encode('utf-8'))
                     
             except requests.RequestException as e:
                 print(f"Network error during translation: {e}")
@@ -295,9 +749,102 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                 self.end_headers()
                 response = {"success": False, "error": str(e)}
                 self.wfile.write(json.dumps(response).encode('utf-8'))
+        elif self.path == '/api/translate_batch':
+            # {"texts": [...], "source": ..., "target": ...}, e.g. to pre-translate the vocabulary of a scene
+            import json
+            try:
+                data = json.loads(post_data)
+                texts = [text for text in data.get('texts', []) if isinstance(text, str) and text.strip()]
+                source_lang = data.get('source', 'auto')
+                target_lang = data.get('target', 'en')
+                
+                if not texts:
+                    raise ValueError("No texts provided for translation")
+                
+                translations = []
+                for text, result in translate.translate_many(texts, source_lang, target_lang):
+                    if isinstance(result, Exception):
+                        translations.append({"success": False, "original_text": text, "error": str(result)})
+                    else:
+                        translations.append(translation_response(text, result, source_lang, target_lang))
+                
+                self.send_response(200)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({"success": True, "translations": translations}).encode('utf-8'))
+            except Exception as e:
+                print(traceback.format_exc())
+                print("Error translating texts:", e)
+                self.send_response(500)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                response = {"success": False, "error": str(e)}
+                self.wfile.write(json.dumps(response).encode('utf-8'))
+        elif self.path in ('/api/worlds/clear', '/api/worlds/delete'):
+            # {"names": [...]} (clear: optional, every world if left out); the response has one progress line
+            # per world, then {"success": true}. If any world failed, the batch is rolled back and the response is a 500
+            import json
+            try:
+                data = json.loads(post_data or b'{}')
+                if not isinstance(data, dict):
+                    raise ValueError("Expected a JSON object")
+                names = data.get('names')
+                if names is not None and (not isinstance(names, list) or not all(isinstance(name, str) for name in names)):
+                    raise ValueError("names must be a list of strings")
+                if names is None and self.path == '/api/worlds/delete':
+                    raise ValueError("names is required")
+            except ValueError as e:
+                self.send_response(400)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({"success": False, "error": str(e)}).encode('utf-8'))
+                return
+            if self.path == '/api/worlds/clear':
+                self.send_batch(storage.clear_worlds, names)
+            else:
+                self.send_batch(storage.delete_worlds, names)
+        elif urlparse(self.path).path == '/api/worlds/import':
+            # Body: the newline-delimited JSON from /api/worlds/export. ?overwrite=1 replaces worlds that already exist.
+            import json
+            try:
+                worlds = [json.loads(line) for line in post_data.decode('utf-8').splitlines() if line.strip()]
+                if not worlds or not all(isinstance(world, dict) for world in worlds):
+                    raise ValueError("Expected one world object per line")
+            except ValueError as e:
+                self.send_response(400)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({"success": False, "error": str(e)}).encode('utf-8'))
+                return
+            overwrite = parse_qs(urlparse(self.path).query).get('overwrite', ['0'])[0] in ('1', 'true')
+            self.send_batch(storage.import_worlds, worlds, overwrite)
+        elif self.path == '/api/vocabulary/analyze':
+            # {"text": ..., "language": ..., "world": optional}: new-word ratio of any text against what the reader has seen
+            import json
+            try:
+                data = json.loads(post_data)
+                text = data.get('text', '')
+                if not text.strip():
+                    raise ValueError("No text provided")
+                response = vocab.analyze_text(text, data.get('language', 'English'), data.get('world'), int(data.get('top', 20)))
+                self.send_response(200)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps(dict(response, success=True)).encode('utf-8'))
+            except (LookupError, ValueError) as e:
+                self.send_response(404 if isinstance(e, LookupError) else 400)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({"success": False, "error": str(e)}).encode('utf-8'))
+            except Exception as e:
+                print(traceback.format_exc())
+                print("Error analyzing vocabulary:", e)
+                self.send_response(500)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({"success": False, "error": str(e)}).encode('utf-8'))
         elif self.path == '/api/create_world':
             import json
-            import glob
             try:
                 data = json.loads(post_data)
                 world_name = data.get('name', '').strip()
@@ -313,19 +860,12 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                 import re
                 world_name = re.sub(r'[^a-zA-Z0-9_-]', '', world_name)
                 
-                # Check if world already exists
-                world_file_path = f"data/{world_name}.json"
-                if os.path.exists(world_file_path):
-                    raise ValueError(f"World '{world_name}' already exists")
-                
-                # Create new world file
-                new_world = {
-                    "description": world_description,
-                    "backstory": []
-                }
+                if not world_name:
+                    raise ValueError("World name must contain letters or numbers")
                 
-                with open(world_file_path, 'w') as f:
-                    json.dump(new_world, f, indent=2)
+                # The frontend refers to worlds by this path, even though they are stored as logs now
+                world_file_path = f"data/{world_name}.json"
+                storage.create_world(world_name, world_description)
                 
                 self.send_response(200)
                 self.send_header('Content-type', 'application/json')
@@ -355,13 +895,7 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                 if not world_name:
                     raise ValueError("World name is required")
                 
-                # Check if world exists
-                world_file_path = f"data/{world_name}.json"
-                if not os.path.exists(world_file_path):
-                    raise ValueError(f"World '{world_name}' does not exist")
-                
-                # Delete the world file
-                os.remove(world_file_path)
+                storage.delete_world(storage.world_name(world_name))
                 
                 self.send_response(200)
                 self.send_header('Content-type', 'application/json')
@@ -386,23 +920,136 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
             self.end_headers()
             self.wfile.write(b'{"error": "POST endpoint not found"}')
 
-def start_server(port=8000):
-    """Start the HTTP server on the specified port"""
-    try:
-        with socketserver.TCPServer(("", port), MyHTTPRequestHandler) as httpd:
-            print(f"Server starting on http://localhost:{port}")
-            print("Press Ctrl+C to stop the server")
+class PooledHTTPServer(http.server.HTTPServer):
+    """HTTPServer that handles each connection on a fixed-size thread pool.
+
+    At most max_workers requests run at once and at most max_queued more wait for a
+    worker; connections beyond that get an immediate 503 instead of piling up.
+    """
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class, max_workers=16, max_queued=64, backlog=128,
+                 reuse_port=False, listener=None):
+        """reuse_port: bind with SO_REUSEPORT, so several processes can listen on the same port and the
+        kernel spreads connections between them. listener: serve this already listening socket (inherited
+        from a parent process) instead of binding a new one."""
+        self.request_queue_size = backlog  # listen() backlog, used by server_activate
+        self.reuse_port = reuse_port
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="http-worker")
+        self.slots = threading.BoundedSemaphore(max_workers + max_queued)
+        self.idle_connections = set()  # connections waiting for their next request
+        self.idle_lock = threading.Lock()
+        self.closing = False
+        super().__init__(server_address, handler_class, bind_and_activate=listener is None)
+        if listener is not None:
+            self.socket.close()
+            self.socket = listener
+            self.server_address = listener.getsockname()
+            self.server_name, self.server_port = self.server_address[:2]
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def get_request(self):
+        request, client_address = super().get_request()
+        # A non-blocking listener (shared between processes, see launcher.py) can hand out non-blocking sockets
+        request.setblocking(True)
+        return request, client_address
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            metrics.http_requests_rejected.inc()
+            try:
+                request.sendall(b'HTTP/1.0 503 Service Unavailable\r\n'
+                                b'Content-type: application/json\r\n'
+                                b'Retry-After: 1\r\n\r\n'
+                                b'{"success": false, "error": "Server is busy"}')
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    @contextmanager
+    def idle(self, connection):
+        """Around a handler's wait for its connection's next request, which server_close() cuts short"""
+        with self.idle_lock:
+            if self.closing:
+                raise ConnectionAbortedError("Server is stopping")
+            self.idle_connections.add(connection)
+        try:
+            yield
+        finally:
+            with self.idle_lock:
+                self.idle_connections.discard(connection)
+
+    def server_close(self):
+        super().server_close()
+        # Idle keep-alive connections are closed; requests that are already running (e.g. a story being generated) finish
+        with self.idle_lock:
+            self.closing = True
+            for connection in self.idle_connections:
+                try:
+                    connection.shutdown(socket.SHUT_RD)
+                except OSError:
+                    pass
+        self.executor.shutdown(wait=True)
+
+def create_server(port, max_workers=None, max_queued=None, backlog=None, **kwargs):
+    """PooledHTTPServer on the specified port; other keyword arguments are passed on to it
+
+    Worker limits default to the SERVER_WORKERS, SERVER_MAX_QUEUED and SERVER_BACKLOG
+    environment variables (16, 64 and 128 if unset).
+    """
+    max_workers = max_workers or int(os.environ.get("SERVER_WORKERS", 16))
+    max_queued = max_queued or int(os.environ.get("SERVER_MAX_QUEUED", 64))
+    backlog = backlog or int(os.environ.get("SERVER_BACKLOG", 128))
+    return PooledHTTPServer(("", port), MyHTTPRequestHandler, max_workers, max_queued, backlog, **kwargs)
+
+def serve(httpd):
+    """Serve until SIGTERM or Ctrl+C, then let in-flight requests finish"""
+    # shutdown() blocks until serve_forever returns, so it can't run on the signal handling thread
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=httpd.shutdown).start())
+    with httpd:
+        try:
             httpd.serve_forever()
-    except KeyboardInterrupt:
-        print("\nServer stopped.")
+        except KeyboardInterrupt:
+            pass
+        print("\nStopping server, waiting for in-flight requests...")
+
+def start_server(port=None, max_workers=None, max_queued=None, backlog=None):
+    """Start the HTTP server in this process on the specified port (the PORT environment variable, or 7005, if not given)
+
+    For more than one process, see launcher.py.
+    """
+    port = port or int(os.environ.get("PORT", 7005))
+    storage.migrate_json_worlds()
+    static_files.preload()
+    try:
+        httpd = create_server(port, max_workers, max_queued, backlog)
     except OSError as e:
-        if e.errno == 48:  # Address already in use
+        if e.errno == errno.EADDRINUSE:
             print(f"Port {port} is already in use. Trying port {port + 1}...")
-            start_server(port + 1)
+            start_server(port + 1, max_workers, max_queued, backlog)
         else:
             print(f"Error starting server: {e}")
+        return
+    print(f"Server starting on http://localhost:{port} with {httpd.max_workers} workers")
+    print("Press Ctrl+C to stop the server")
+    serve(httpd)
+    print("Server stopped.")
 
 if __name__ == "__main__":
-    # Default port is 7000, but you can change it here
-    PORT = 7005
-    start_server(PORT)
\ No newline at end of file
+    start_server()
@@ -0,0 +1,90 @@
+import os
+import gzip
+import hashlib
+import mimetypes
+import threading
+import responses
+
+try:
+    import brotli  # optional, only used to precompress text assets
+except ImportError:
+    brotli = None
+
+# The index page and everything under static/, ready to send: text assets are kept in memory along with
+# their gzip (and brotli, if installed) versions, other files (the images) are sent straight from disk with sendfile.
+# Assets are reloaded when their file changes.
+
+STATIC_DIR = "static"
+INDEX_FILE = "duo.html"
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "image/svg+xml")
+MAX_IN_MEMORY_SIZE = 1024 * 1024
+
+class Asset:
+    def __init__(self, path, cache_control):
+        st = os.stat(path)
+        self.path = path
+        self.stamp = (st.st_ino, st.st_size, st.st_mtime_ns)
+        self.size = st.st_size
+        self.content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if self.content_type.startswith("text/"):
+            self.content_type += "; charset=utf-8"
+        self.cache_control = cache_control
+        self.body = None  # bytes, if the asset is served from memory
+        self.encodings = {}  # content-encoding -> compressed body
+        compressible = self.content_type.startswith(COMPRESSIBLE_TYPES)
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            if compressible and self.size <= MAX_IN_MEMORY_SIZE:
+                self.body = f.read()
+                digest.update(self.body)
+            else:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(block)
+        self.etag = '"' + digest.hexdigest() + '"'
+        if self.body is not None:
+            self.encodings["gzip"] = gzip.compress(self.body, compresslevel=9)
+            if brotli is not None:
+                self.encodings["br"] = brotli.compress(self.body)
+
+    def choose_encoding(self, accept_encoding):
+        """Best precompressed version the client accepts, or None for the uncompressed body"""
+        for encoding in ("br", "gzip"):
+            if encoding in self.encodings and responses.accepts_encoding(accept_encoding, encoding):
+                return encoding
+        return None
+
+_assets = {}  # file path -> Asset
+_assets_lock = threading.Lock()
+
+def _load(path, cache_control):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    with _assets_lock:
+        asset = _assets.get(path)
+    if asset is not None and asset.stamp == (st.st_ino, st.st_size, st.st_mtime_ns):
+        return asset
+    asset = Asset(path, cache_control)
+    with _assets_lock:
+        _assets[path] = asset
+    return asset
+
+def get_index():
+    # Revalidated on every load, so a new duo.html is picked up right away
+    return _load(INDEX_FILE, "no-cache")
+
+def get_static(url_path):
+    """Asset for a /static/... URL path, or None if there is no such file"""
+    relative = os.path.normpath(url_path.lstrip("/"))
+    if not relative.startswith(STATIC_DIR + os.sep):
+        return None  # e.g. /static/../server.py
+    if not os.path.isfile(relative):
+        return None
+    return _load(relative, "public, max-age=86400")
+
+def preload():
+    get_index()
+    if os.path.isdir(STATIC_DIR):
+        for name in os.listdir(STATIC_DIR):
+            get_static(f"/{STATIC_DIR}/{name}")
@@ -0,0 +1,735 @@
+import os
+import re
+import json
+import glob
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, ExitStack
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import metrics
+from story_format import parse_completion
+try:
+    import fcntl
+except ImportError:  # Windows: worlds are only locked within the process
+    fcntl = None
+
+# Each world is stored as an append-only log, data/<name>.jsonl, with one JSON record per line:
+#   {"op": "create", "description": ..., "backstory": [...], "stories": [...]}   always the first record
+#   {"op": "append", "story": i, "text": ..., "fields": {...}}                 add a scene to story i (i == len(backstory) starts a new story)
+#                                                                              ("language": the scene's language, if known)
+#   {"op": "clear"}                                                            remove every story
+# Adding a scene only writes one line, instead of rewriting the whole world like the old data/<name>.json files.
+#
+# The cleaned text, <info> and <summary> of each scene ("fields") are extracted once when it is written.
+# Loaded worlds carry them per story in world["stories"], so nothing has to re-parse the backstory.
+
+DATA_DIR = "data"
+
+# World names become file names (data/<name>.jsonl, data/.locks/<name>), so nothing but these characters is allowed
+WORLD_NAME_PATTERN = re.compile(r"^[a-zA-Z0-9_-]+$")
+
+def check_world_name(name):
+    """Raise ValueError unless name can be used as a world name"""
+    if not isinstance(name, str) or not WORLD_NAME_PATTERN.fullmatch(name):
+        raise ValueError(f"Invalid world name: {name!r}")
+
+# Loaded worlds are kept in memory (least recently used first out) while their log's inode, size and mtime
+# are unchanged. Appends made through this module update the cached copy instead of invalidating it.
+WORLD_CACHE_BYTES = int(os.environ.get("WORLD_CACHE_BYTES", 64 * 1024 * 1024))
+_cache = OrderedDict()  # name -> (stamp, world, size in bytes)
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+cache_stats = {"hits": 0, "misses": 0, "evictions": 0}  # guarded by _cache_lock
+
+def get_cache_stats():
+    with _cache_lock:
+        return dict(cache_stats, worlds=len(_cache), bytes=_cache_bytes)
+
+# Every change to a world happens while holding its lock (see world_lock). Different worlds don't share a lock.
+# Besides the in-process lock, the holder has an flock on data/.locks/<name>, so worker processes started by
+# launcher.py (or any other process using this module) don't write to the same world at once.
+# Locks are only taken for worlds that exist (or are being created), and a deleted world's lock goes with it.
+LOCK_DIR = os.path.join(DATA_DIR, ".locks")
+_world_locks = {}
+_world_locks_lock = threading.Lock()
+lock_stats = metrics.Stats(acquired=0, contended=0, wait_seconds_total=0.0, wait_seconds_max=0.0)
+
+def get_lock_stats():
+    return lock_stats.snapshot()
+
+class _WorldLock:
+    """Re-entrant lock held by one thread of one process at a time"""
+    def __init__(self, name):
+        self.name = name
+        self.thread_lock = threading.RLock()
+        self.depth = 0  # re-entries by the owning thread; the flock is taken on the first and dropped on the last
+        self.file = None
+        self.discarded = False  # the world was deleted; world_lock() moves on to a new lock
+
+    def acquire(self, blocking=True):
+        if not self.thread_lock.acquire(blocking):
+            return False
+        if self.depth == 0 and fcntl is not None and not self.discarded:
+            try:
+                self._lock_file(blocking)
+            except BaseException as e:
+                self.thread_lock.release()
+                if isinstance(e, BlockingIOError):
+                    return False
+                raise
+        self.depth += 1
+        return True
+
+    def _lock_file(self, blocking):
+        path = os.path.join(LOCK_DIR, self.name)
+        while True:
+            if self.file is None:
+                os.makedirs(LOCK_DIR, exist_ok=True)
+                self.file = open(path, "a")
+            fcntl.flock(self.file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # Another process may have deleted the world, and removed this file, while we waited for it
+            try:
+                current = os.stat(path)
+            except FileNotFoundError:
+                current = None
+            held = os.fstat(self.file.fileno())
+            if current is not None and (current.st_ino, current.st_dev) == (held.st_ino, held.st_dev):
+                return
+            self.file.close()
+            self.file = None
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0 and self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            if self.discarded:
+                self.file.close()
+                self.file = None
+        self.thread_lock.release()
+
+def _reset_world_locks():
+    """In a forked child: the parent's lock files share their flocks with it, so start over with new ones"""
+    global _world_locks, _world_locks_lock
+    for lock in _world_locks.values():
+        if lock.file is not None:
+            lock.file.close()
+    _world_locks = {}
+    _world_locks_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_world_locks)
+
+@contextmanager
+def world_lock(name):
+    """Hold the world's lock for the duration of a with block; re-entrant, so storage calls can be made inside it"""
+    check_world_name(name)
+    start = time.perf_counter()
+    contended = False
+    while True:
+        with _world_locks_lock:
+            lock = _world_locks.get(name)
+            if lock is None:
+                lock = _world_locks[name] = _WorldLock(name)
+        if not lock.acquire(blocking=False):
+            contended = True
+            lock.acquire()
+        if not lock.discarded:
+            break
+        lock.release()  # the world was deleted while we waited
+    waited = time.perf_counter() - start
+    lock_stats.count("acquired")
+    if contended:
+        lock_stats.count("contended")
+        lock_stats.observe("wait_seconds", waited)
+    try:
+        yield
+    finally:
+        lock.release()
+
+def _discard_world_lock(name):
+    """With the world's lock held, as the world is deleted: forget the lock and remove its file"""
+    with _world_locks_lock:
+        lock = _world_locks.pop(name, None)
+    if lock is not None:
+        lock.discarded = True
+    try:
+        os.remove(os.path.join(LOCK_DIR, name))
+    except FileNotFoundError:
+        pass
+
+# Functions called as listener(world name, story index) after a world has been changed, for caches
+# built on top of storage. The story index is None when the whole world may have changed.
+change_listeners = []
+
+def _notify(name, story_idx=None):
+    for listener in change_listeners:
+        listener(name, story_idx)
+
+def world_name(world_file):
+    """'data/world0.json' -> 'world0' (the frontend still refers to worlds by their old json path)"""
+    name = os.path.basename(world_file)
+    for ext in (".jsonl", ".json"):
+        if name.endswith(ext):
+            return name[:-len(ext)]
+    return name
+
+def log_path(name):
+    check_world_name(name)
+    return os.path.join(DATA_DIR, f"{name}.jsonl")
+
+def legacy_path(name):
+    check_world_name(name)
+    return os.path.join(DATA_DIR, f"{name}.json")
+
+def list_worlds():
+    migrate_json_worlds()
+    names = (world_name(path) for path in glob.glob(os.path.join(DATA_DIR, "*.jsonl")))
+    return sorted(name for name in names if WORLD_NAME_PATTERN.fullmatch(name))
+
+def world_exists(name):
+    return os.path.exists(log_path(name)) or os.path.exists(legacy_path(name))
+
+def world_stamp(name):
+    """Size and mtime of a world's log, which change whenever the world does"""
+    path = log_path(name)
+    if not os.path.exists(path):
+        migrate_json_world(name)
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+def library_stamp():
+    """Fingerprint of every stored world plus the latest modification time, without reading any of them"""
+    migrate_json_worlds()
+    entries = []
+    last_modified = 0
+    for path in sorted(glob.glob(os.path.join(DATA_DIR, "*.jsonl"))):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue  # deleted while we were listing
+        entries.append(f"{world_name(path)}:{st.st_size}:{st.st_mtime_ns}")
+        last_modified = max(last_modified, st.st_mtime)
+    return "|".join(entries), last_modified
+
+def _fsync_dir(path):
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _write_staged(path, data):
+    """Write and fsync the contents for `path` to a temporary file next to it; returns the temporary file's path"""
+    tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    encoded = data.encode("utf-8")
+    with metrics.world_write_duration.time(op="rewrite"):
+        with open(tmp_path, "wb") as f:
+            f.write(encoded)
+            f.flush()
+            os.fsync(f.fileno())
+    metrics.world_write_bytes.inc(len(encoded), op="rewrite")
+    return tmp_path
+
+def _write_atomic(path, data):
+    """Write a whole file so that readers (and a crash) only ever see the old or the new version"""
+    os.replace(_write_staged(path, data), path)
+    _fsync_dir(os.path.dirname(path) or ".")
+
+def _stamp(st):
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+def _copy_world(world):
+    # Callers may append to these lists; the strings and per-story dicts are never modified in place
+    return {"description": world["description"], "backstory": list(world["backstory"]), "stories": list(world["stories"])}
+
+def _cache_put(name, stamp, world, size):
+    global _cache_bytes
+    with _cache_lock:
+        if name in _cache:
+            _cache_bytes -= _cache.pop(name)[2]
+        if size > WORLD_CACHE_BYTES:
+            return
+        _cache[name] = (stamp, world, size)
+        _cache_bytes += size
+        while _cache_bytes > WORLD_CACHE_BYTES:
+            _, (_, _, evicted_size) = _cache.popitem(last=False)
+            _cache_bytes -= evicted_size
+            cache_stats["evictions"] += 1
+
+def invalidate(name=None):
+    """Drop a world (or every world) from the cache"""
+    global _cache_bytes
+    with _cache_lock:
+        names = [name] if name is not None else list(_cache)
+        for n in names:
+            if n in _cache:
+                _cache_bytes -= _cache.pop(n)[2]
+
+def _append_record(name, record):
+    path = log_path(name)
+    if not os.path.exists(path):
+        migrate_json_world(name)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"World '{name}' does not exist")
+    line = (json.dumps(record) + "\n").encode("utf-8")
+    start = time.perf_counter()
+    fd = os.open(path, os.O_RDWR | os.O_APPEND)
+    try:
+        # If a previous write was cut off by a crash, start on a fresh line so the torn record stays isolated
+        before = os.fstat(fd)
+        if before.st_size and os.pread(fd, 1, before.st_size - 1) != b"\n":
+            line = b"\n" + line
+        os.write(fd, line)
+        os.fsync(fd)
+        after = os.fstat(fd)
+    finally:
+        os.close(fd)
+    metrics.world_write_duration.observe(time.perf_counter() - start, op="append")
+    metrics.world_write_bytes.inc(len(line), op="append")
+
+    # Apply the record to the cached world, unless someone else wrote to the log since it was cached
+    global _cache_bytes
+    with _cache_lock:
+        entry = _cache.get(name)
+        if entry is None:
+            return
+        if entry[0][:2] == _stamp(before)[:2] and after.st_size == before.st_size + len(line):
+            _apply(entry[1], record)
+            _cache[name] = (_stamp(after), entry[1], entry[2] + len(line))
+            _cache_bytes += len(line)
+            return
+    invalidate(name)
+
+def extract_fields(content):
+    fields = parse_completion(content)
+    return {
+        "text": fields["text"],
+        "info": fields["info"],
+        "summary": fields["summary"],
+        "ended": fields["ended"],
+    }
+
+def _join(first, second, separator="\n"):
+    return separator.join(part for part in (first, second) if part)
+
+def _combine_fields(story, scene):
+    """Fields of a story after a scene is appended to it.
+
+    Same as extract_fields on the concatenated content, except that scenes are always
+    separated by exactly one blank line in "text".
+    """
+    return {
+        "text": story["text"] if story["ended"] else _join(story["text"], scene["text"], "\n\n"),
+        "info": _join(story["info"], scene["info"]),
+        "summary": _join(story["summary"], scene["summary"]),
+        "ended": story["ended"] or scene["ended"],
+    }
+
+def _apply(world, record):
+    op = record.get("op")
+    if op == "create":
+        world["description"] = record.get("description", "")
+        world["backstory"] = list(record.get("backstory", []))
+        world["stories"] = record.get("stories") or [extract_fields(content) for content in world["backstory"]]
+    elif op == "append":
+        idx = record["story"]
+        while len(world["backstory"]) <= idx:
+            world["backstory"].append("")
+            world["stories"].append(extract_fields(""))
+        world["backstory"][idx] += record["text"]
+        # Appending invalidates the story's fields; rebuild them from the scene's precomputed ones
+        world["stories"][idx] = _combine_fields(world["stories"][idx], record.get("fields") or extract_fields(record["text"]))
+    elif op == "clear":
+        world["backstory"] = []
+        world["stories"] = []
+
+def load_world(name):
+    """Replay a world's log into the {"description", "backstory"} dict the json files used to hold, plus "stories" """
+    path = log_path(name)
+    if not os.path.exists(path):
+        migrate_json_world(name)
+    st = os.stat(path)
+    with _cache_lock:
+        entry = _cache.get(name)
+        if entry is not None and entry[0] == _stamp(st):
+            _cache.move_to_end(name)
+            cache_stats["hits"] += 1
+            return _copy_world(entry[1])
+        cache_stats["misses"] += 1
+    world = _read_log(path)
+    _cache_put(name, _stamp(st), world, st.st_size)
+    return _copy_world(world)
+
+def _read_log(path):
+    world = {"description": "", "backstory": [], "stories": []}
+    start = time.perf_counter()
+    with open(path, "r", encoding="utf-8") as f:
+        size = os.fstat(f.fileno()).st_size
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Only a write interrupted by a crash can leave a partial line; it was never acknowledged, so skip it
+                print(f"Skipping corrupt record in {path}")
+                continue
+            _apply(world, record)
+    metrics.world_read_duration.observe(time.perf_counter() - start)
+    metrics.world_read_bytes.inc(size)
+    return world
+
+def read_records(name, offset=0):
+    """Records of a world's log from byte `offset` on, for indexes that follow the log.
+
+    Returns (records, offset just past the last complete line, inode of the log); a smaller size
+    or a different inode next time means the log was rewritten and has to be read from the start.
+    """
+    with open(log_path(name), "rb") as f:
+        inode = os.fstat(f.fileno()).st_ino
+        f.seek(offset)
+        data = f.read()
+    metrics.world_read_bytes.inc(len(data))
+    end = data.rfind(b"\n") + 1  # a line still being written is left for next time
+    records = []
+    for line in data[:end].splitlines():
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue  # torn by a crash, see _read_log
+    return records, offset + end, inode
+
+class LogFollower:
+    """Keeps data derived from the world logs (e.g. an index) up to date by reading only what was appended.
+
+    reset(name) is called when a world is seen for the first time, was rewritten (compacted, imported over)
+    or was deleted, and apply(name, record) for every record read from its log after that. `lock` is held
+    during both; owners use it to guard their own data too. positions holds how far each log has been read,
+    {name: (inode, offset)}, and can be saved and restored along with the derived data.
+    """
+    def __init__(self, reset, apply):
+        self.reset = reset
+        self.apply = apply
+        self.positions = {}
+        self.lock = threading.RLock()
+
+    def refresh(self, name):
+        """Catch up with a world's log; cheap when nothing changed. Returns whether anything did."""
+        if not os.path.exists(log_path(name)):
+            # Outside self.lock: migrating takes the world's lock, and writers call listeners while holding it
+            migrate_json_world(name)
+        with self.lock:
+            try:
+                st = os.stat(log_path(name))
+            except FileNotFoundError:
+                if self.positions.pop(name, None) is None:
+                    return False
+                self.reset(name)
+                return True
+            position = self.positions.get(name)
+            if position == (st.st_ino, st.st_size):
+                return False
+            offset = 0
+            if position is not None and position[0] == st.st_ino and position[1] <= st.st_size:
+                offset = position[1]
+            else:
+                self.reset(name)
+            records, end, inode = read_records(name, offset)
+            if offset and inode != st.st_ino:
+                # Replaced between the stat and the read
+                self.reset(name)
+                records, end, inode = read_records(name, 0)
+            for record in records:
+                self.apply(name, record)
+            self.positions[name] = (inode, end)
+            return True
+
+    def forget_missing(self, names):
+        """Reset every followed world that isn't in names (e.g. storage.list_worlds())"""
+        with self.lock:
+            for name in set(self.positions) - set(names):
+                del self.positions[name]
+                self.reset(name)
+
+def create_world(name, description, backstory=None):
+    with world_lock(name):
+        if world_exists(name):
+            raise ValueError(f"World '{name}' already exists")
+        backstory = backstory or []
+        record = {"op": "create", "description": description, "backstory": backstory,
+                  "stories": [extract_fields(content) for content in backstory]}
+        _write_atomic(log_path(name), json.dumps(record) + "\n")
+        invalidate(name)
+    _notify(name)
+
+def append_scene(name, story_idx, text, language=None):
+    record = {"op": "append", "story": story_idx, "text": text, "fields": extract_fields(text)}
+    if language:
+        record["language"] = language
+    with world_lock(name):
+        _append_record(name, record)
+    _notify(name, story_idx)
+
+def clear_world(name):
+    if not world_exists(name):
+        raise ValueError(f"World '{name}' does not exist")
+    with world_lock(name):
+        _append_record(name, {"op": "clear"})
+        _compact(name)
+    _notify(name)
+
+def delete_world(name):
+    if not world_exists(name):
+        raise ValueError(f"World '{name}' does not exist")
+    with world_lock(name):
+        if not world_exists(name):
+            raise ValueError(f"World '{name}' does not exist")
+        for path in (log_path(name), legacy_path(name)):
+            if os.path.exists(path):
+                os.remove(path)
+        invalidate(name)
+        _discard_world_lock(name)
+    _notify(name)
+
+def compact_world(name):
+    """Rewrite a world's log as a single create record, dropping cleared stories and per-scene records"""
+    with world_lock(name):
+        _compact(name)
+    _notify(name)
+
+def _compact(name):
+    # Done right after every clear, so cleared stories don't stay on disk and get replayed by every cold load
+    world = load_world(name)
+    record = {"op": "create", "description": world["description"], "backstory": world["backstory"],
+              "stories": world["stories"]}
+    _write_atomic(log_path(name), json.dumps(record) + "\n")
+    invalidate(name)
+
+def migrate_json_world(name):
+    """One-shot conversion of data/<name>.json to the log format; the json file is kept as <name>.json.bak"""
+    check_world_name(name)
+    if not os.path.exists(legacy_path(name)):
+        return  # nothing to migrate, and no lock (or lock file) for a world that doesn't exist
+    with world_lock(name):
+        json_path = legacy_path(name)
+        if not os.path.exists(json_path) or os.path.exists(log_path(name)):
+            return
+        with open(json_path, "r") as f:
+            world = json.load(f)
+        backstory = world.get("backstory", [])
+        record = {"op": "create", "description": world.get("description", ""), "backstory": backstory,
+                  "stories": [extract_fields(content) for content in backstory]}
+        _write_atomic(log_path(name), json.dumps(record) + "\n")
+        os.replace(json_path, json_path + ".bak")
+        print(f"Migrated {json_path} to {log_path(name)}")
+
+def migrate_json_worlds():
+    for json_path in glob.glob(os.path.join(DATA_DIR, "*.json")):
+        try:
+            migrate_json_world(world_name(json_path))
+        except Exception as e:
+            print(f"Error migrating world file {json_path}: {e}")
+
+# Bulk operations on many worlds at once. Each one holds the locks of all the worlds involved, does the
+# slow part (fsyncing files) on BULK_IO_WORKERS threads, and is all or nothing: if any world fails, the
+# worlds already done are put back the way they were. The whole batch, including telling the change listeners,
+# is done before they return, so the locks are never held while a client reads the result: clear, delete and
+# import return a list of progress events ({"world", "status", "done", "total"}), one per world, and raise
+# ValueError if the request is invalid. export_worlds is a generator, its validation errors come from the first next().
+
+BULK_IO_WORKERS = int(os.environ.get("BULK_IO_WORKERS", 8))
+
+@contextmanager
+def _locked(names):
+    # Always taken in the same order, so two batches can't deadlock
+    with ExitStack() as stack:
+        for name in sorted(set(names)):
+            stack.enter_context(world_lock(name))
+        yield
+
+def _in_parallel(function, items):
+    """Yield (item, exception or None) as function(item) finishes for each item"""
+    with ThreadPoolExecutor(max_workers=BULK_IO_WORKERS, thread_name_prefix="bulk-io") as executor:
+        futures = {executor.submit(function, item): item for item in items}
+        for future in as_completed(futures):
+            yield futures[future], future.exception()
+
+def _check_exist(names):
+    if len(set(names)) != len(names):
+        raise ValueError("The same world is listed more than once")
+    missing = [name for name in names if not world_exists(name)]
+    if missing:
+        raise ValueError(f"Worlds do not exist: {', '.join(missing)}")
+
+def _check_names(names):
+    invalid = []
+    for name in names:
+        try:
+            check_world_name(name)
+        except ValueError:
+            invalid.append(repr(name))
+    if invalid:
+        raise ValueError(f"Invalid world names: {', '.join(invalid)}")
+
+def _valid_fields(story):
+    """Whether an imported story entry looks like extract_fields() output, so it can be stored as is"""
+    return (isinstance(story, dict) and all(isinstance(story.get(key), str) for key in ("text", "info", "summary"))
+            and isinstance(story.get("ended", False), bool))
+
+def _progress(name, status, done, total):
+    return {"world": name, "status": status, "done": done, "total": total}
+
+def clear_worlds(names=None):
+    """Clear every world (or the given ones) as one batch"""
+    names = list_worlds() if names is None else list(names)
+    _check_names(names)
+    _check_exist(names)  # before locking: no locks (or lock files) for worlds that don't exist
+    events = []
+    with _locked(names):
+        _check_exist(names)
+        for name in names:
+            migrate_json_world(name)
+        sizes = {name: os.path.getsize(log_path(name)) for name in names}
+        error = None
+        for name, e in _in_parallel(lambda name: _append_record(name, {"op": "clear"}), names):
+            if e is not None:
+                error = error or e
+                continue
+            events.append(_progress(name, "cleared", len(events) + 1, len(names)))
+        if error is not None:
+            # Cut the clear records off again (and anything a failed write left behind)
+            for name in names:
+                os.truncate(log_path(name), sizes[name])
+                invalidate(name)
+            raise error
+        # The batch is done; compacting only saves space, so a world that fails to compact keeps its clear record
+        for name, e in _in_parallel(_compact, names):
+            if e is not None:
+                print(f"Error compacting cleared world {name}: {e}")
+        for name in names:
+            _notify(name)
+    return events
+
+def delete_worlds(names):
+    """Delete the given worlds as one batch"""
+    names = list(names)
+    _check_names(names)
+    _check_exist(names)  # before locking: no locks (or lock files) for worlds that don't exist
+    with _locked(names):
+        _check_exist(names)
+        # Renaming is quick and easy to undo, so every file is moved aside before anything is removed
+        moved = []
+        try:
+            for name in names:
+                for path in (log_path(name), legacy_path(name)):
+                    if os.path.exists(path):
+                        os.replace(path, path + ".deleted")
+                        moved.append(path)
+        except Exception:
+            for path in reversed(moved):
+                os.replace(path + ".deleted", path)
+            raise
+        _fsync_dir(DATA_DIR)
+        for name in names:
+            invalidate(name)
+
+        def remove(name):
+            for path in (log_path(name), legacy_path(name)):
+                if path in moved:
+                    os.remove(path + ".deleted")
+        events = []
+        for name, e in _in_parallel(remove, names):
+            if e is not None:
+                print(f"Error removing deleted world {name}: {e}")  # already gone as far as readers are concerned
+            events.append(_progress(name, "deleted", len(events) + 1, len(names)))
+        for name in names:
+            _discard_world_lock(name)
+            _notify(name)
+    return events
+
+def export_worlds(names=None):
+    """Yield {"name", "description", "backstory", "stories"} for every world (or the given ones), loaded in parallel"""
+    names = list_worlds() if names is None else list(names)
+    _check_names(names)
+    _check_exist(names)
+    chunk = BULK_IO_WORKERS * 2  # worlds loaded ahead of the one being yielded
+    with ThreadPoolExecutor(max_workers=BULK_IO_WORKERS, thread_name_prefix="bulk-io") as executor:
+        for i in range(0, len(names), chunk):
+            for name, world in zip(names[i:i + chunk], executor.map(load_world, names[i:i + chunk])):
+                yield {"name": name, **world}
+
+def import_worlds(worlds, overwrite=False):
+    """Create worlds from export_worlds records as one batch; existing worlds are only replaced if overwrite is set"""
+    worlds = list(worlds)
+    names = [world.get("name") for world in worlds]
+    _check_names(names)
+    if len(set(names)) != len(names):
+        raise ValueError("The same world is listed more than once")
+    for world in worlds:
+        backstory = world.get("backstory") or []
+        if not isinstance(backstory, list) or not all(isinstance(content, str) for content in backstory):
+            raise ValueError(f"World '{world['name']}': backstory must be a list of strings")
+        if not isinstance(world.get("description", ""), str):
+            raise ValueError(f"World '{world['name']}': description must be a string")
+    with _locked(names):
+        existing = [name for name in names if world_exists(name)]
+        if existing and not overwrite:
+            raise ValueError(f"Worlds already exist: {', '.join(existing)}")
+
+        def stage(world):
+            backstory = list(world.get("backstory") or [])
+            stories = world.get("stories")
+            if (not isinstance(stories, list) or len(stories) != len(backstory)
+                    or not all(_valid_fields(story) for story in stories)):
+                stories = [extract_fields(content) for content in backstory]
+            record = {"op": "create", "description": world.get("description", ""), "backstory": backstory, "stories": stories}
+            return _write_staged(log_path(world["name"]), json.dumps(record) + "\n")
+
+        # The new logs are written and fsynced next to the old ones first; only then are they renamed into place
+        events = []
+        staged = {}
+        with ThreadPoolExecutor(max_workers=BULK_IO_WORKERS, thread_name_prefix="bulk-io") as executor:
+            futures = {executor.submit(stage, world): world["name"] for world in worlds}
+            error = None
+            for future in as_completed(futures):
+                try:
+                    staged[futures[future]] = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                events.append(_progress(futures[future], "staged", len(staged), len(names)))
+        replaced = []
+        committed = []
+        try:
+            if error is not None:
+                raise error
+            for name in names:
+                for path in (log_path(name), legacy_path(name)):
+                    if os.path.exists(path):
+                        os.replace(path, path + ".replaced")
+                        replaced.append(path)
+                os.replace(staged[name], log_path(name))
+                del staged[name]
+                committed.append(name)
+            _fsync_dir(DATA_DIR)
+        except Exception:
+            for name in committed:
+                os.remove(log_path(name))
+            for path in reversed(replaced):
+                os.replace(path + ".replaced", path)
+            for tmp_path in staged.values():
+                os.remove(tmp_path)
+            raise
+        for path in replaced:
+            os.remove(path + ".replaced")
+        for i, name in enumerate(names):
+            invalidate(name)
+            events.append(_progress(name, "imported", i + 1, len(names)))
+        for name in names:
+            _notify(name)
+    return events
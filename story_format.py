@@ -0,0 +1,153 @@
+# Helpers for the completion format the prompts ask for: <info> and <summary> blocks around the
+# scene text, and a final <end> line once the whole play/story is finished.
+
+def get_text(content):
+    lines = content.split("\n")
+    in_info = False
+    in_summary = False
+    filtered_lines = []
+    for line in lines:
+        if line.startswith("<info>"):
+            in_info = True
+        elif line.startswith("</info>"):
+            in_info = False
+        elif line.startswith("<summary>"):
+            in_summary = True
+        elif line.startswith("</summary>"):
+            in_summary = False
+        elif line.startswith("<end>"):
+            break
+        elif not in_info and not in_summary:
+            filtered_lines.append(line)
+    return "\n".join(filtered_lines).strip()
+
+def get_info(content):
+    lines = content.split("\n")
+    in_info = False
+    info_lines = []
+    for line in lines:
+        if line.startswith("<info>"):
+            in_info = True
+        elif line.startswith("</info>"):
+            in_info = False
+        elif in_info:
+            info_lines.append(line)
+    return "\n".join(info_lines).strip()
+
+def get_summary(content):
+    lines = content.split("\n")
+    in_summary = False
+    summary_lines = []
+    for line in lines:
+        if line.startswith("<summary>"):
+            in_summary = True
+        elif line.startswith("</summary>"):
+            in_summary = False
+        elif in_summary:
+            summary_lines.append(line)
+    return "\n".join(summary_lines).strip()
+
+def is_ended(content):
+    return any(line.startswith("<end>") for line in content.split("\n"))
+
+def split_scenes(content):
+    """Split a story's raw content into the completions it was built from (each one starts with an <info> block)"""
+    scenes = []
+    current = []
+    for line in content.split("\n"):
+        if line.startswith("<info>") and any(l.strip() for l in current):
+            scenes.append("\n".join(current))
+            current = []
+        current.append(line)
+    if any(l.strip() for l in current):
+        scenes.append("\n".join(current))
+    return scenes
+
+# Lines starting with one of these are tags, never text
+TAGS = ("<info>", "</info>", "<summary>", "</summary>", "<end>")
+
+# Segment kinds produced by CompletionParser
+TITLE = "title"
+SCENE = "scene"
+INFO = "info"
+SUMMARY = "summary"
+END = "end"
+
+class CompletionParser:
+    """Single pass over a completion, as a whole string or in chunks, producing (kind, line) segments
+
+    The lines of each kind are exactly the ones get_text (TITLE and SCENE), get_info (INFO) and
+    get_summary (SUMMARY) would keep, so one pass replaces calling all three.
+    """
+    def __init__(self):
+        self.in_info = False
+        self.in_summary = False
+        self.ended = False
+        self.partial = ""
+
+    def feed(self, chunk):
+        """Segments for the lines completed by this chunk"""
+        lines = (self.partial + chunk).split("\n")
+        self.partial = lines.pop()
+        segments = []
+        for line in lines:
+            self._parse_line(line, segments)
+        return segments
+
+    def partial_is_text(self):
+        """Whether the incomplete last line is already known to be text get_text keeps (it can't become a tag)"""
+        if self.ended or self.in_info or self.in_summary:
+            return False
+        return not any(self.partial.startswith(tag) or tag.startswith(self.partial) for tag in TAGS)
+
+    def close(self):
+        """Segments for the last line"""
+        segments = []
+        self._parse_line(self.partial, segments)
+        self.partial = ""
+        return segments
+
+    def _parse_line(self, line, segments):
+        is_tag = False
+        if line.startswith("<info>"):
+            self.in_info = is_tag = True
+        elif line.startswith("</info>"):
+            self.in_info = False
+            is_tag = True
+        elif self.in_info:
+            segments.append((INFO, line))
+        if line.startswith("<summary>"):
+            self.in_summary = is_tag = True
+        elif line.startswith("</summary>"):
+            self.in_summary = False
+            is_tag = True
+        elif self.in_summary:
+            segments.append((SUMMARY, line))
+        if line.startswith("<end>"):
+            segments.append((END, line))
+            self.ended = True
+        elif not is_tag and not self.ended and not self.in_info and not self.in_summary:
+            segments.append((TITLE if line.startswith("# ") else SCENE, line))
+
+def parse_completion(content):
+    """get_text, get_info and get_summary of content (plus whether it has ended and its title) in one pass"""
+    parser = CompletionParser()
+    lines = {TITLE: [], INFO: [], SUMMARY: []}
+    text_lines = []
+    ended = False
+    for kind, line in parser.feed(content) + parser.close():
+        if kind == END:
+            ended = True
+        elif kind == SCENE:
+            text_lines.append(line)
+        else:
+            lines[kind].append(line)
+            if kind == TITLE:
+                text_lines.append(line)
+    return {
+        "text": "\n".join(text_lines).strip(),
+        "info": "\n".join(lines[INFO]).strip(),
+        "summary": "\n".join(lines[SUMMARY]).strip(),
+        "ended": ended,
+        "title": lines[TITLE][0][2:].strip() if lines[TITLE] else None,
+    }
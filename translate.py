@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import urllib.parse
+from concurrent.futures import Future, ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+
+# Translations of highlighted words/phrases, from the Free Translate API (ftapi.pythonanywhere.com).
+# Results are cached on disk per (text, source, target), and concurrent requests for the same
+# text share a single API call. Point TRANSLATE_API_URL at fakes.py's server to test without the real API.
+
+TRANSLATE_API_URL = os.environ.get("TRANSLATE_API_URL", "https://ftapi.pythonanywhere.com/translate")
+TRANSLATE_TIMEOUT = float(os.environ.get("TRANSLATE_TIMEOUT", 15))
+CACHE_PATH = os.environ.get("TRANSLATION_CACHE_PATH", os.path.join("data", "translations.sqlite3"))
+CACHE_TTL = float(os.environ.get("TRANSLATION_CACHE_TTL", 30 * 24 * 3600))
+CACHE_MAX_ENTRIES = int(os.environ.get("TRANSLATION_CACHE_MAX_ENTRIES", 50000))
+BATCH_MAX_TEXTS = 200
+BATCH_WORKERS = 4
+
+class TranslationError(Exception):
+    """The translate API answered, but not with a translation"""
+
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+stats = metrics.Stats(hits=0, misses=0, coalesced=0, errors=0)
+
+def get_stats():
+    return stats.snapshot()
+
+_db = None
+_db_lock = threading.Lock()
+_puts_since_trim = 0
+_in_flight = {}  # (text, source, target) -> Future of the API call that is already running
+_in_flight_lock = threading.Lock()
+_batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="translate")
+
+def _get_db():
+    global _db
+    if _db is None:
+        os.makedirs(os.path.dirname(CACHE_PATH) or ".", exist_ok=True)
+        _db = sqlite3.connect(CACHE_PATH, check_same_thread=False)
+        # Server processes started by launcher.py share the file: with WAL, reads don't wait for another process's writes
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.execute("""CREATE TABLE IF NOT EXISTS translations (
+            text TEXT, source TEXT, target TEXT, result TEXT, created REAL, last_used REAL,
+            PRIMARY KEY (text, source, target))""")
+        _db.execute("CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)")
+        _db.commit()
+    return _db
+
+def _cache_get(key):
+    now = time.time()
+    with _db_lock:
+        db = _get_db()
+        row = db.execute("SELECT result, created FROM translations WHERE text = ? AND source = ? AND target = ?", key).fetchone()
+        if row is None:
+            return None
+        if row[1] + CACHE_TTL < now:
+            db.execute("DELETE FROM translations WHERE text = ? AND source = ? AND target = ?", key)
+            db.commit()
+            return None
+        db.execute("UPDATE translations SET last_used = ? WHERE text = ? AND source = ? AND target = ?", (now,) + key)
+        db.commit()
+    return json.loads(row[0])
+
+def _cache_put(key, result):
+    global _puts_since_trim
+    now = time.time()
+    with _db_lock:
+        db = _get_db()
+        db.execute("INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?, ?)", key + (json.dumps(result), now, now))
+        _puts_since_trim += 1
+        if _puts_since_trim >= 100:
+            # Over the size limit: forget the least recently used translations
+            _puts_since_trim = 0
+            count = db.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+            if count > CACHE_MAX_ENTRIES:
+                db.execute("DELETE FROM translations WHERE rowid IN (SELECT rowid FROM translations ORDER BY last_used LIMIT ?)",
+                           (count - CACHE_MAX_ENTRIES,))
+        db.commit()
+
+def fetch_translation(text, source="auto", target="en"):
+    """Call the translate API directly, without the cache"""
+    encoded_text = urllib.parse.quote(text)
+    if source == "auto":
+        # Use the auto-detect method (only dl and text)
+        url = f"{TRANSLATE_API_URL}?dl={target}&text={encoded_text}"
+    else:
+        url = f"{TRANSLATE_API_URL}?sl={source}&dl={target}&text={encoded_text}"
+    start = time.perf_counter()
+    try:
+        response = session.get(url, timeout=TRANSLATE_TIMEOUT)
+    except requests.RequestException:
+        metrics.translate_request_duration.observe(time.perf_counter() - start, outcome="network_error")
+        raise
+    metrics.translate_request_duration.observe(time.perf_counter() - start,
+                                               outcome="ok" if response.status_code == 200 else f"http_{response.status_code}")
+    if response.status_code != 200:
+        raise TranslationError(f"Translation API returned status {response.status_code}: {response.text}")
+    return response.json()
+
+def translate(text, source="auto", target="en"):
+    """Translation API result for text, from the cache if possible
+
+    Raises requests.RequestException if the API can't be reached and TranslationError if it returns an error.
+    """
+    key = (text, source, target)
+    cached = _cache_get(key)
+    if cached is not None:
+        stats.count("hits")
+        return cached
+
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _in_flight[key] = future
+    if not owner:
+        stats.count("coalesced")
+        return future.result()
+
+    stats.count("misses")
+    try:
+        result = fetch_translation(text, source, target)
+        _cache_put(key, result)
+        future.set_result(result)
+        return result
+    except Exception as e:
+        stats.count("errors")
+        future.set_exception(e)
+        raise
+    finally:
+        with _in_flight_lock:
+            _in_flight.pop(key, None)
+
+def translate_many(texts, source="auto", target="en"):
+    """Translate several texts at once; returns (text, result or exception) pairs in the order given"""
+    if len(texts) > BATCH_MAX_TEXTS:
+        raise ValueError(f"At most {BATCH_MAX_TEXTS} texts can be translated at once")
+    unique_texts = list(dict.fromkeys(texts))
+    futures = {text: _batch_executor.submit(translate, text, source, target) for text in unique_texts}
+    results = []
+    for text in texts:
+        try:
+            results.append((text, futures[text].result()))
+        except Exception as e:
+            results.append((text, e))
+    return results
@@ -0,0 +1,284 @@
+import os
+import re
+import gzip
+import json
+import time
+import threading
+from collections import Counter
+import storage
+from story_format import get_text
+
+# Vocabulary index over every scene the reader can see, for measuring how many words of a scene are new
+# (the app aims for about 20% new, 80% familiar). Each world's part of the index follows its log: it remembers
+# how far into data/<name>.jsonl it has read and only parses the records added since, so nothing is rescanned
+# when a scene is appended. A log that was rewritten (compacted, imported over) or deleted is reindexed or dropped.
+#
+# Per language there is an inverted index, word -> {(world, story): occurrences}, and a frequency table used
+# for ranks. The per-scene word counts are saved to data/vocabulary.json.gz so a restart doesn't rebuild them.
+
+INDEX_PATH = os.path.join(storage.DATA_DIR, "vocabulary.json.gz")
+INDEX_VERSION = 2
+SAVE_DELAY = 30  # seconds after a change before the index is written to disk
+TARGET_NEW_RATIO = 0.2
+UNKNOWN_LANGUAGE = "unknown"  # scenes saved before their language was recorded
+
+# Runs of letters; digits, punctuation and markdown are separators, so "l'homme" gives "l" and "homme"
+WORD_RE = re.compile(r"[^\W\d_]+")
+
+class WorldIndex:
+    def __init__(self):
+        self.scenes = []  # (story index, language, Counter of words), in log order
+        self.first_seen = {}  # language -> {word: position in self.scenes of the first scene using it}
+
+_worlds = {}  # world name -> WorldIndex
+_postings = {}  # language -> {word: Counter({(world, story): occurrences})}
+_frequencies = {}  # language -> Counter of words over every world
+_ranks = {}  # language -> (version, {word: rank}), recomputed when the frequencies change
+_versions = Counter()  # language -> number of changes to its frequencies
+_save_timer = None
+_loaded = False
+stats = {"scenes_indexed": 0, "worlds_reset": 0, "saves": 0}
+
+def tokenize(text):
+    """Lower-cased words of a scene; words written all in capitals are character names, not vocabulary"""
+    return [word.casefold() for word in WORD_RE.findall(text) if not (len(word) > 1 and word.isupper())]
+
+def _add_scene(name, world_index, story, language, text):
+    counts = Counter(tokenize(text))
+    position = len(world_index.scenes)
+    world_index.scenes.append((story, language, counts))
+    _index_counts(name, world_index, position)
+
+def _index_counts(name, world_index, position):
+    story, language, counts = world_index.scenes[position]
+    first_seen = world_index.first_seen.setdefault(language, {})
+    postings = _postings.setdefault(language, {})
+    for word, count in counts.items():
+        first_seen.setdefault(word, position)
+        postings.setdefault(word, Counter())[(name, story)] += count
+    _frequencies.setdefault(language, Counter()).update(counts)
+    _versions[language] += 1
+    stats["scenes_indexed"] += 1
+
+def _remove_world(name):
+    world_index = _worlds.pop(name, None)
+    if world_index is None:
+        return
+    for story, language, counts in world_index.scenes:
+        postings = _postings.get(language, {})
+        for word, count in counts.items():
+            entry = postings.get(word)
+            if entry is not None:
+                entry[(name, story)] -= count
+                if entry[(name, story)] <= 0:
+                    del entry[(name, story)]
+                if not entry:
+                    del postings[word]
+        _frequencies[language].subtract(counts)
+        _versions[language] += 1
+    for language in {language for _, language, _ in world_index.scenes}:
+        _frequencies[language] = +_frequencies[language]  # drop the words that no longer occur
+
+def _reset_world(name):
+    _remove_world(name)
+    stats["worlds_reset"] += 1
+
+def _apply(name, record):
+    world_index = _worlds.get(name)
+    if world_index is None:
+        world_index = _worlds[name] = WorldIndex()
+    op = record.get("op")
+    if op == "create":
+        stories = record.get("stories") or []
+        for i, content in enumerate(record.get("backstory", [])):
+            text = stories[i]["text"] if i < len(stories) else get_text(content)
+            if text:
+                _add_scene(name, world_index, i, UNKNOWN_LANGUAGE, text)
+    elif op == "append":
+        fields = record.get("fields") or {}
+        text = fields.get("text") if "text" in fields else get_text(record["text"])
+        if text:
+            _add_scene(name, world_index, record["story"], record.get("language") or UNKNOWN_LANGUAGE, text)
+    elif op == "clear":
+        _remove_world(name)
+        _worlds[name] = WorldIndex()
+
+_follower = storage.LogFollower(_reset_world, _apply)
+_lock = _follower.lock
+
+def refresh(name):
+    """Bring a world's part of the index up to date with its log (cheap when nothing changed)"""
+    with _lock:
+        if not _loaded:
+            _load()
+    if _follower.refresh(name):
+        _schedule_save()
+
+def refresh_all():
+    names = storage.list_worlds()
+    with _lock:
+        if not _loaded:
+            _load()
+    _follower.forget_missing(names)
+    for name in names:
+        refresh(name)
+
+def _on_change(name, story_idx):
+    try:
+        refresh(name)
+    except Exception as e:
+        print(f"Error updating the vocabulary index for {name}: {e}")
+
+storage.change_listeners.append(_on_change)
+
+def _rank_table(language):
+    version = _versions[language]
+    cached = _ranks.get(language)
+    if cached is None or cached[0] != version:
+        ordered = _frequencies.get(language, Counter()).most_common()
+        cached = _ranks[language] = (version, {word: rank for rank, (word, _) in enumerate(ordered, start=1)})
+    return cached[1]
+
+def _scenes_of(world_index, story):
+    return [(position, scene) for position, scene in enumerate(world_index.scenes) if scene[0] == story]
+
+def _report(counts, language, is_seen, top):
+    ranks = _rank_table(language)
+    total = sum(counts.values())
+    unseen = Counter({word: count for word, count in counts.items() if not is_seen(word)})
+    new_tokens = sum(unseen.values())
+    return {
+        "language": language,
+        "tokens": total,
+        "unique_words": len(counts),
+        "new_tokens": new_tokens,
+        "new_words": len(unseen),
+        "new_word_ratio": new_tokens / total if total else 0.0,
+        "target_new_ratio": TARGET_NEW_RATIO,
+        "top_unseen": [{"word": word, "count": count, "rank": ranks.get(word)} for word, count in unseen.most_common(top)],
+        "ranks": {word: ranks.get(word) for word in counts},
+    }
+
+def analyze_scene(world, story, scene=-1, scope="world", top=20):
+    """New-word statistics of one stored scene (the scene-th of the story, negative counts from the end).
+
+    A word is new if it doesn't occur in an earlier scene of the same story (scope="story"), of the same
+    world (scope="world") or of any world in the same language (scope="language"); earlier means earlier in the log.
+    """
+    refresh(world)
+    if scope == "language":
+        refresh_all()
+    with _lock:
+        world_index = _worlds.get(world)
+        if world_index is None:
+            raise LookupError(f"World '{world}' does not exist")
+        story_scenes = _scenes_of(world_index, story)
+        if not story_scenes:
+            raise LookupError(f"Story {story} of world '{world}' has no scenes")
+        if not -len(story_scenes) <= scene < len(story_scenes):
+            raise LookupError(f"Story {story} of world '{world}' has no scene {scene}")
+        scene %= len(story_scenes)
+        position, (_, language, counts) = story_scenes[scene]
+
+        first_seen = world_index.first_seen.get(language, {})
+        if scope == "story":
+            earlier = set()
+            for p, (_, _, scene_counts) in story_scenes:
+                if p < position:
+                    earlier.update(scene_counts)
+            is_seen = earlier.__contains__
+        elif scope == "world":
+            is_seen = lambda word: first_seen.get(word, position) < position
+        elif scope == "language":
+            postings = _postings.get(language, {})
+            is_seen = lambda word: (first_seen.get(word, position) < position
+                                    or any(key[0] != world for key in postings.get(word, ())))
+        else:
+            raise ValueError(f"Unknown scope '{scope}'")
+        report = _report(counts, language, is_seen, top)
+    report.update(world=world, story=story, scene=scene, scope=scope)
+    return report
+
+def analyze_text(text, language, world=None, top=20):
+    """New-word statistics of any text against everything in `world`, or in every world, in that language"""
+    if world is not None:
+        refresh(world)
+    else:
+        refresh_all()
+    with _lock:
+        if world is not None:
+            world_index = _worlds.get(world)
+            if world_index is None:
+                raise LookupError(f"World '{world}' does not exist")
+            known = world_index.first_seen.get(language, {})
+        else:
+            known = _postings.get(language, {})
+        report = _report(Counter(tokenize(text)), language, known.__contains__, top)
+    report.update(world=world, scope="world" if world is not None else "language")
+    return report
+
+def word_locations(word, language):
+    """Where a word occurs: its rank in the language and [{"world", "story", "count"}]"""
+    refresh_all()
+    word = word.casefold()
+    with _lock:
+        entry = _postings.get(language, {}).get(word, Counter())
+        return {
+            "word": word,
+            "language": language,
+            "rank": _rank_table(language).get(word),
+            "count": _frequencies.get(language, Counter())[word],
+            "occurrences": [{"world": world, "story": story, "count": count} for (world, story), count in entry.most_common()],
+        }
+
+def get_stats():
+    with _lock:
+        return dict(stats, worlds=len(_worlds), languages=len(_frequencies),
+                    words=sum(len(counts) for counts in _frequencies.values()))
+
+def _schedule_save():
+    global _save_timer
+    if _save_timer is None:
+        _save_timer = threading.Timer(SAVE_DELAY, save)
+        _save_timer.daemon = True
+        _save_timer.start()
+
+def save():
+    """Write the per-scene word counts (and how far each log has been read) to INDEX_PATH"""
+    global _save_timer
+    with _lock:
+        _save_timer = None
+        data = {"version": INDEX_VERSION, "worlds": {
+            name: {"position": _follower.positions.get(name),
+                   "scenes": [[story, language, dict(counts)] for story, language, counts in world_index.scenes]}
+            for name, world_index in _worlds.items() if name in _follower.positions}}
+        encoded = gzip.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+    tmp_path = f"{INDEX_PATH}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(encoded)
+    os.replace(tmp_path, INDEX_PATH)
+    with _lock:
+        stats["saves"] += 1
+
+def _load():
+    """Start from the saved index; worlds that changed since are caught up by refresh()"""
+    global _loaded
+    _loaded = True
+    try:
+        with open(INDEX_PATH, "rb") as f:
+            data = json.loads(gzip.decompress(f.read()))
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable vocabulary index {INDEX_PATH}: {e}")
+        return
+    if data.get("version") != INDEX_VERSION:
+        return  # rebuilt from the logs
+    start = time.perf_counter()
+    for name, saved in data.get("worlds", {}).items():
+        world_index = _worlds[name] = WorldIndex()
+        _follower.positions[name] = tuple(saved["position"])
+        for story, language, counts in saved["scenes"]:
+            world_index.scenes.append((story, language, Counter(counts)))
+            _index_counts(name, world_index, len(world_index.scenes) - 1)
+    print(f"Loaded vocabulary index for {len(_worlds)} worlds in {time.perf_counter() - start:.2f} s")